@@ -1,53 +1,318 @@
 # basefuncs.py 
 """Template definitions of functions"""
 
-from scipy import optimize
 import numpy as np
 
+import instrument
+from solvers import illinois
+from kitchen import freeze
+
 def linfunc(x, const, slope)-> float:
     '''Returns f(x_) = const + slope * x'''
     return const + slope * x
    
 def linlogfunc(x, const, slope)-> float:
-    '''Returns levels. f(x) = const^slope'''
-    if x > 0: 
-        return const * x**slope
-    else:
-        return 1e-6
-        
+    '''Returns levels. f(x) = const * x^slope, 1e-6 for x <= 0.
+    Works element-wise on arrays'''
+    x = np.asarray(x, dtype=float)
+    pos = x > 0
+    res = np.where(pos, const * np.where(pos, x, 1.)**slope, 1e-6)
+    return res[()]
+
+def lininv(y, const, slope):
+    '''Inverse of linfunc: returns x = (y - const) / slope'''
+    return (y - const) / slope
+
+def linloginv(y, const, slope):
+    '''Inverse of linlogfunc: returns x = (y/const)^(1/slope), nan for y < 0'''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        res = (np.asarray(y, dtype=float) / const)**(1. / slope)
+    return res[()]
+
+def linint(x, const, slope):
+    '''Antiderivative of linfunc: const*x + slope*x^2/2'''
+    return const * x + slope * x**2 / 2
+
+def linlogint(x, const, slope):
+    '''Antiderivative of linlogfunc: const*x^(slope+1)/(slope+1), 
+    or const*log(x) if slope = -1. 1e-6*x for x <= 0.
+    const and slope can be arrays'''
+    x = np.asarray(x, dtype=float)
+    pos = x > 0
+    xp = np.where(pos, x, 1.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = np.where(np.equal(slope, -1), const * np.log(xp),
+                       const * xp**(np.add(slope, 1)) / np.add(slope, 1))
+    res = np.where(pos, res, 1e-6 * x)
+    return res[()]
+
+def linelas(x, const, slope):
+    '''Point elasticity of linfunc: slope*x / (const + slope*x)'''
+    return slope * x / linfunc(x, const, slope)
+
+def linlogelas(x, const, slope):
+    '''Point elasticity of linlogfunc: the constant slope'''
+    res = np.full(np.shape(x), slope, dtype=float)
+    return res[()]
+
+
+################################################################
+# tabulated curves
+################################################################
+
+# monotone splines of the tables in use, see tab_spline()
+_splines = {}
+# points per segment of the table through which the inverse spline runs
+INV_SUB = 16
+# Newton steps that polish the inverse
+INV_NEWTON = 2
+
+def tab_spline(p, q):
+    '''Returns the monotone cubic (PCHIP) spline through the table of
+    points (p, q), built once per table and kept in _splines: a dict with the
+    knots 'x' and 'y', the coefficients 'c' of the cubic
+    c0*dx^3 + c1*dx^2 + c2*dx + c3 on each segment, dx from its left end 'a',
+    and the antiderivative 'F' at the left ends. The first and last segments
+    are the linear extensions beyond the table. The inverse is kept alike, 
+    as 'ic' and 'ia' over the knots 'iy' (of sign 'isign' * q): a monotone 
+    spline through INV_SUB points per segment of the spline.
+    p must be positive and increasing, q strictly monotone'''
+    key = (tuple(np.ravel(p).tolist()), tuple(np.ravel(q).tolist()))
+    spl = _splines.get(key)
+    if spl is None:
+        from scipy.interpolate import PchipInterpolator
+        x, y = np.array(key[0], dtype=float), np.array(key[1], dtype=float)
+        if len(x) < 2 or len(x) != len(y) or np.any(np.diff(x) <= 0) or x[0] <= 0:
+            raise ValueError("A table needs at least 2 points (p, q) with positive, increasing p")
+        sign = 1. if y[-1] > y[0] else -1.
+        if np.any(sign*np.diff(y) <= 0):
+            raise ValueError("The tabulated quantities q must be strictly monotone in p")
+        pchip = PchipInterpolator(x, y)
+        ds = pchip.derivative()(x[[0, -1]])
+        # segment i of x lies between knots i-1 and i, 0 and n are the lines
+        c = np.column_stack([[0., 0., ds[0], y[0]], pchip.c, [0., 0., ds[1], y[-1]]])
+        h = np.diff(x)
+        F = np.concatenate([[0., 0.], np.cumsum(((pchip.c[0]*h/4 + pchip.c[1]/3)*h
+                                                 + pchip.c[2]/2)*h**2 + pchip.c[3]*h)])
+
+        # inverse: sign*q is increasing, its lines have slopes sign/ds
+        xs = np.append((x[:-1, None] + h[:, None]*np.arange(INV_SUB)/INV_SUB).ravel(), x[-1])
+        ys = sign*pchip(xs)
+        if np.any(np.diff(ys) <= 0):
+            raise ValueError("The tabulated quantities q must be strictly monotone in p")
+        ipchip = PchipInterpolator(ys, xs)
+        # beyond a flat end the price stays at the end of the table
+        islope = np.divide(sign, ds, out=np.zeros(2), where=ds != 0)
+        ic = np.column_stack([[0., 0., islope[0], x[0]], ipchip.c, [0., 0., islope[1], x[-1]]])
+        spl = {'x': x, 'y': y, 'c': c, 'a': np.concatenate([x[:1], x]), 'F': F,
+               'isign': sign, 'iy': ys, 'ic': ic, 'ia': np.concatenate([ys[:1], ys]),
+               'ilo': np.concatenate([[-np.inf], xs]), 'ihi': np.concatenate([xs, [np.inf]])}
+        _splines[key] = spl
+    return spl
+
+def _tab_locate(spl, x):
+    # segments of x and their coefficients, distance to their left ends
+    i = np.searchsorted(spl['x'], x, side='right')
+    return spl['c'][:, i], x - spl['a'][i], i
+
+def _tab_eval(spl, x):
+    # the spline and its lines at x
+    c, dx, _ = _tab_locate(spl, x)
+    return ((c[0]*dx + c[1])*dx + c[2])*dx + c[3]
+
+def tabfunc(x, p, q):
+    '''Returns f(x) of the table of points (p, q): the monotone
+    spline through them, linear beyond the table. 1e-6 for x <= 0, as
+    linlogfunc, so that curves end at positive prices'''
+    x = np.asarray(x, dtype=float)
+    return np.where(x > 0, _tab_eval(tab_spline(p, q), x), 1e-6)[()]
+
+def tabinv(y, p, q):
+    '''Inverse of tabfunc: the precomputed inverse spline, polished by 
+    Newton steps on the spline, kept between the points of the inverse.
+    Where these do not converge (nearly flat parts), illinois() between them.
+    0 for the values that the linear extension only reaches at x <= 0'''
+    spl = tab_spline(p, q)
+    y = np.asarray(y, dtype=float)
+    sy = spl['isign']*y
+    j = np.searchsorted(spl['iy'], sy, side='right')
+    c, d = spl['ic'][:, j], sy - spl['ia'][j]
+    x = ((c[0]*d + c[1])*d + c[2])*d + c[3]
+    lo, hi = spl['ilo'][j], spl['ihi'][j]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(INV_NEWTON):
+            c, dx, _ = _tab_locate(spl, x)
+            df = (3*c[0]*dx + 2*c[1])*dx + c[2]
+            step = (((c[0]*dx + c[1])*dx + c[2])*dx + c[3] - y)/df
+            x = np.clip(np.where(np.isfinite(step), x - step, x), lo, hi)
+    slow = ~(np.abs(step) <= 1e-9*(1. + np.abs(x))) & np.isfinite(lo + hi)
+    if np.any(slow):
+        x, y, lo, hi = [np.array(v, dtype=float, ndmin=1) for v in np.broadcast_arrays(x, y, lo, hi)]
+        slow = np.atleast_1d(slow)
+        yi = y[slow]
+        x[slow] = illinois(lambda z: _tab_eval(spl, z) - yi, lo[slow], hi[slow], 
+                           xtol=1e-15)[0]
+        x = x.reshape(np.shape(sy))
+    return np.maximum(x, 0.)[()]
+
+def tabint(x, p, q):
+    '''Antiderivative of tabfunc, 0 at the first point of the table'''
+    spl = tab_spline(p, q)
+    x = np.asarray(x, dtype=float)
+    c, dx, i = _tab_locate(spl, np.maximum(x, 0.))
+    res = spl['F'][i] + (((c[0]*dx/4 + c[1]/3)*dx + c[2]/2)*dx + c[3])*dx
+    return (res + 1e-6*np.minimum(x, 0.))[()]
+
+def tabelas(x, p, q):
+    '''Point elasticity of tabfunc: f'(x)*x / f(x)'''
+    x = np.asarray(x, dtype=float)
+    c, dx, _ = _tab_locate(tab_spline(p, q), x)
+    df = (3*c[0]*dx + 2*c[1])*dx + c[2]
+    f = ((c[0]*dx + c[1])*dx + c[2])*dx + c[3]
+    return np.where(x > 0, df * x / f, 0.)[()]
+
+def tabulate(func, lo, hi, num=50):
+    '''Returns the parameters {'p': ..., 'q': ...} of the 'tab' family for 
+    func(p), e.g. an expensive fitted model, tabulated once at num prices 
+    spaced geometrically from lo to hi (> 0)'''
+    p = np.geomspace(lo, hi, num)
+    q = np.array([func(v) for v in p], dtype=float)
+    return {'p': p.tolist(), 'q': q.tolist()}
+
+
+# registry of function families 
+# 'f': the function, 'inv': its exact inverse, 'int': its antiderivative,
+# 'elas': its point elasticity 
+# only 'f' is required, f_inv, f_int and f_elas fall back on numerical methods
+# 'lin' and 'linlog' take the parameters const and slope, 'tab' the table of
+# points p and q (see tabulate() for curves given as functions)
+funcs = {'lin': {'f': linfunc, 'inv': lininv, 'int': linint, 'elas': linelas},
+          'linlog': {'f': linlogfunc, 'inv': linloginv, 'int': linlogint, 
+                     'elas': linlogelas},
+          'tab': {'f': tabfunc, 'inv': tabinv, 'int': tabint, 'elas': tabelas}
+        }    
+
+
+def get_registered(f, key):
+    '''Returns the entry key (e.g. 'inv') registered in funcs for 
+    function f, None if f is not a registered family or has no such entry'''
+    for fam in funcs.values():
+        if fam['f'] is f:
+            return fam.get(key)
+    return None
+
+
+# memoized tables (x, f(x)) used to bracket inverses of unregistered functions
+_inv_tables = {}
+INV_GRID = np.geomspace(1e-6, 1e6, 241)
+
+def inv_table(f, **pars):
+    '''Returns a memoized table (x, f(x)) over INV_GRID for f with parameters
+    pars, which may hold lists and arrays but must make f scalar'''
+    key = (f, freeze(pars))
+    if key not in _inv_tables:
+        y = np.array([f(x, **pars) for x in INV_GRID], dtype=float)
+        if y.shape != INV_GRID.shape:
+            raise ValueError(f"Cannot invert {getattr(f, '__name__', f)} numerically: "
+                             "its parameters must give scalar values")
+        _inv_tables[key] = (INV_GRID, y)
+    return _inv_tables[key]
 
     
-def f_inv(f, exo):
-    ''' returns inverted function by using numerical root finding
-    y = f(x) => x = f^-1(y)
+def f_inv(f, exo, **pars):
+    ''' returns inverted function 
+    y = f(x, **pars) => x = f^-1(y)
     e.g. if y = f(X) 
     f_inv(f, exo=10) finds the value of X for which y = 10 
+
+    If f is one of the families in funcs, its registered exact inverse is used. 
+    Otherwise the tabulated f (see inv_table) brackets the solution, which is 
+    then found by Brent's method. If exo lies outside the table, it reverts 
+    to root finding from the nearest tabulated point. Arrays exo are solved 
+    element by element.
     
     Parameters:
     f : a function 
-    exo: the targeted exogenous value of f(x)  
+    exo: the targeted exogenous value of f(x), scalar or array
+    pars: keyword parameters of f
 
     Returns: 
-    x : float
+    x : float, or array shaped like exo
     '''
-    eps = 1e-6
+    inv = get_registered(f, 'inv')
+    if inv is not None:
+        return inv(exo, **pars)
 
-    def func(*args, **kwargs):
-        return exo - f(*args, **kwargs)
-            
-    inv = optimize.root(func, x0 = eps)
-    
+    if np.ndim(exo) > 0:
+        return np.vectorize(lambda y: f_inv(f, y, **pars), otypes=[float])(exo)
+
+    from scipy import optimize
+
+    def func(x):
+        return f(x, **pars) - exo
+
+    x, y = inv_table(f, **pars)
+    dev = y - exo
+    if np.any(dev == 0):
+        return x[np.argmax(dev == 0)]
+    cross = np.nonzero(np.sign(dev[:-1]) != np.sign(dev[1:]))[0]
+    if cross.size > 0:
+        i = cross[0]
+        root, r = optimize.brentq(func, x[i], x[i+1], full_output=True)
+        stats = instrument.current()
+        if stats is not None:
+            stats.solver('brentq', r.converged, nit=r.iterations, nfev=r.function_calls,
+                         message=r.flag)
+        return root
+
+    x0 = x[np.argmin(np.abs(dev))]
+    inv = optimize.root(func, x0 = x0)
+    stats = instrument.current()
+    if stats is not None:
+        stats.solver('root', inv.success, nfev=inv.nfev, message=inv.message)
     return inv.x[0]
 
 
-funcs = {'lin': {'f': linfunc},
-          'linlog': {'f': linlogfunc}
-        }    
+def f_int(f, a, b, **pars):
+    ''' returns the definite integral of f(x, **pars) from a to b
+
+    Uses the registered antiderivative if f is one of the families in funcs,
+    and numerical quadrature otherwise. a and b can be arrays.
+    '''
+    F = get_registered(f, 'int')
+    if F is not None:
+        return F(b, **pars) - F(a, **pars)
+
+    from scipy.integrate import quad
+
+    def integral(lo, hi):
+        val, abserr, info = quad(lambda x: f(x, **pars), lo, hi, full_output=1)[:3]
+        stats = instrument.current()
+        if stats is not None:
+            stats.quad_err(abserr, info['neval'])
+        return val
+
+    res = np.vectorize(integral, otypes=[float])(a, b)
+    return res[()]
 
 
 def elas(func, x):
-    '''calculates elasticity of func at point x'''
+    '''calculates elasticity of func at point x, by the backward difference
+    of np.gradient's first point (as for scalars before). x can be an array
+    if func takes arrays'''
     dx_x = 0.001
-    dz = np.gradient([func(x*(1-dx_x)), func(x), func(x*(1+dx_x))])
-    el = dz[0]/func(x)*(1/dx_x)
-    return el 
\ No newline at end of file
+    x = np.asarray(x, dtype=float)
+    fx = func(x)
+    el = (fx - func(x*(1-dx_x)))/fx*(1/dx_x)
+    return el[()] if isinstance(el, np.ndarray) else el
+
+
+def f_elas(f, x, **pars):
+    ''' returns the point elasticity of f(x, **pars) at x, 
+    x can be an array. 
+    Uses the registered elasticity if f is one of the families in funcs, 
+    and numerical differences (see elas) otherwise.'''
+    el = get_registered(f, 'elas')
+    if el is not None:
+        return el(x, **pars)
+    return elas(lambda z: f(z, **pars), x)
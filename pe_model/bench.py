@@ -0,0 +1,240 @@
+# bench.py
+"""Benchmarks of the model's hot paths
+
+Each case runs a fixed workload on a TradeModel, for every calibration in
+CALIBRATIONS and both tariff types, and reports
+    time:  best wall time over the repeats (seconds)
+    calls: number of calls of homedem, homesup and expsup
+    evals: number of points at which they were evaluated (array sizes)
+    peak:  peak memory allocated by Python during one run (KiB, tracemalloc)
+The cache of tariff-independent results is cleared before every run.
+
+Results can be saved as a JSON baseline, and later runs compared to it:
+a case regresses when time, evals or peak grow by more than the threshold.
+
+Run as:
+    python bench.py                         runs and prints the results
+    python bench.py --save base.json        also saves them as baseline
+    python bench.py --compare base.json     exits with 1 on a regression
+    python bench.py --threshold 0.3 --repeat 7 --cases trademodel,opt_scan
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+import pe_model as mod
+from basefuncs import elas
+import init
+import instrument
+
+CALIBRATIONS = ['linear.json', 'linlog.json', 'tabulated.json']
+TARTYPES = ['Ave', 'Specific']
+# number of tariffs in the workloads, as fractions of the prohibitive tariff
+NTAR = 20
+# regressions below these many seconds and KiB are noise
+MIN_TIME = 1e-3
+MIN_PEAK = 64.
+
+
+################################################################
+# workloads: setup(model, tartype) returns the arguments of run
+################################################################
+
+def tariff_grid(model, tartype):
+    prohib = model.prohibitive_tariff(tartype, eps=1e-5)
+    return prohib * np.linspace(0., 0.9, NTAR)
+
+def setup_tariffs(model, tartype):
+    return (tariff_grid(model, tartype), tartype)
+
+def setup_equil(model, tartype):
+    pw, _ = model.free_trade_equil()
+    tariffs = tariff_grid(model, tartype)
+    eq = model.trademodel_batch(tariffs, tartype)
+    return (pw, eq, tariffs, tartype)
+
+def run_trademodel(model, tariffs, tartype):
+    for val in tariffs:
+        model.trademodel(mod.create_tar_instance(tartype, val))
+
+def run_trademodel_batch(model, tariffs, tartype):
+    model.trademodel_batch(tariffs, tartype)
+
+def run_generate_markets(model, tariffs, tartype):
+    model.generate_markets()
+
+def run_home_welf(model, pw, eq, tariffs, tartype):
+    for p_t, pstar in zip(eq['pstar_t'], eq['pstar']):
+        model.home_welf(pw, p_t, pstar)
+
+def run_foreign_welf(model, pw, eq, tariffs, tartype):
+    for pstar in eq['pstar']:
+        model.foreign_welf(pw, pstar)
+
+def run_expprice(model, pw, eq, tariffs, tartype):
+    for x in eq['xstar']:
+        model.expprice(x)
+
+def run_elas(model, pw, eq, tariffs, tartype):
+    for p_t, pstar, val in zip(eq['pstar_t'], eq['pstar'], tariffs):
+        model.homedem_elas(p_t)
+        model.homesup_elas(p_t)
+        model.impdem_elas(pstar)
+        model.expsup_elas(p_t, mod.create_tar_instance(tartype, val))
+
+def run_elas_fd(model, pw, eq, tariffs, tartype):
+    for p_t, pstar in zip(eq['pstar_t'], eq['pstar']):
+        elas(model.homedem, p_t)
+        elas(model.homesup, p_t)
+        elas(model.impdem, pstar)
+        elas(lambda p: model.expsup(p, 0), pstar)
+
+def run_opt_scan(model, tariffs, tartype):
+    ''' the optimal tariff scan of runmodel.py'''
+    pw = model.generate_markets()['pw']
+    prohib = model.prohibitive_tariff(tartype, eps=1e-5)
+    tar_grid = np.append(np.arange(0.0, prohib, 0.01), prohib)
+    eq_grid = model.trademodel_batch(tar_grid, tartype)
+    model.home_welf(pw, eq_grid['pstar_t'], eq_grid['pstar'])
+    model.find_optimal_tariff(tartype)
+    weights = np.array([4, 3, 2])/9
+    model.find_optimal_tariff(tartype, objective=dict(zip(['dCS', 'dPS', 'dRev'], weights)))
+
+CASES = {'trademodel': (setup_tariffs, run_trademodel),
+         'trademodel_batch': (setup_tariffs, run_trademodel_batch),
+         'generate_markets': (setup_tariffs, run_generate_markets),
+         'home_welf': (setup_equil, run_home_welf),
+         'foreign_welf': (setup_equil, run_foreign_welf),
+         'expprice': (setup_equil, run_expprice),
+         'elas': (setup_equil, run_elas),
+         'elas_fd': (setup_equil, run_elas_fd),
+         'opt_scan': (setup_tariffs, run_opt_scan),
+         }
+
+
+################################################################
+# running and comparing
+################################################################
+
+def bench_case(params, tartype, case, repeat=5):
+    ''' Runs case on a TradeModel(params) with tariff type tartype.
+    Returns a dict with time, calls, evals and peak'''
+    setup, run = CASES[case]
+    model = mod.TradeModel(params)
+    args = setup(model, tartype)
+
+    times = []
+    for _ in range(repeat):
+        mod.clear_cache()
+        t0 = time.perf_counter()
+        run(model, *args)
+        times.append(time.perf_counter() - t0)
+
+    mod.clear_cache()
+    with instrument.recording() as stats:
+        tracemalloc.start()
+        run(model, *args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {'time': min(times),
+            'calls': sum(c for c, _ in stats.evals.values()),
+            'evals': sum(n for _, n in stats.evals.values()),
+            'peak': peak / 1024}
+
+
+def run_all(cases=None, calibrations=None, repeat=5):
+    ''' Runs the cases (default: all) for all calibrations and tariff types.
+    Returns the results dict keyed by "calibration/tartype/case"'''
+    cases = list(CASES) if cases is None else cases
+    calibrations = CALIBRATIONS if calibrations is None else calibrations
+    results = {}
+    for calib in calibrations:
+        with open(init.PARPATH / calib, 'r') as openfile:
+            params = json.load(openfile)
+        for tartype in TARTYPES:
+            for case in cases:
+                key = f"{Path(calib).stem}/{tartype}/{case}"
+                results[key] = bench_case(params, tartype, case, repeat)
+    return results
+
+
+def compare(results, baseline, threshold=0.25):
+    ''' Compares results with a baseline. Returns a list of
+    (key, measure, baseline value, new value) of regressions beyond threshold'''
+    regressions = []
+    for key, res in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for measure in ['time', 'evals', 'peak']:
+            old, new = base[measure], res[measure]
+            if (measure == 'time' and new < MIN_TIME) or (measure == 'peak' and new < MIN_PEAK):
+                continue
+            if new > old*(1. + threshold):
+                regressions.append((key, measure, old, new))
+    return regressions
+
+
+def report(results, baseline=None):
+    ''' Returns the results as a text table, with ratios to the baseline'''
+    lines = [f"{'case':<40}{'time (ms)':>12}{'calls':>10}{'evals':>10}{'peak (KiB)':>12}"
+             + (f"{'x time':>9}{'x evals':>9}" if baseline else "")]
+    for key, res in results.items():
+        line = (f"{key:<40}{res['time']*1e3:>12.3f}{res['calls']:>10d}"
+                f"{res['evals']:>10d}{res['peak']:>12.1f}")
+        if baseline and key in baseline:
+            base = baseline[key]
+            line += (f"{res['time']/base['time']:>9.2f}"
+                     f"{res['evals']/max(base['evals'], 1):>9.2f}")
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of pe_model's hot paths")
+    parser.add_argument('--save', help="save the results as JSON baseline to this file")
+    parser.add_argument('--compare', help="JSON baseline to compare with")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="relative growth counted as regression (default 0.25)")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per case")
+    parser.add_argument('--cases', help=f"comma separated subset of {', '.join(CASES)}")
+    parser.add_argument('--calibrations', help="comma separated parameter files")
+    args = parser.parse_args(argv)
+
+    cases = args.cases.split(',') if args.cases else None
+    calibrations = args.calibrations.split(',') if args.calibrations else None
+    results = run_all(cases, calibrations, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as openfile:
+            baseline = json.load(openfile)['results']
+    print(report(results, baseline))
+
+    if args.save:
+        meta = {'python': platform.python_version(), 'numpy': np.__version__,
+                'machine': platform.machine(), 'date': time.strftime('%Y-%m-%d %H:%M')}
+        with open(args.save, 'w') as openfile:
+            json.dump({'meta': meta, 'results': results}, openfile, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for key, measure, old, new in regressions:
+            print(f"REGRESSION {key} {measure}: {old:.4g} -> {new:.4g}")
+        if regressions:
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# diskcache.py
+"""Persistent, content-addressed cache of results in an SQLite file
+
+Entries are keyed by the sha256 digest of their inputs (see digest()) and
+stored pickled, with the version of the code that produced them. Only the
+entries of the cache's own version are returned, so results of other code
+are never used, even when processes of several versions share the file.
+The total size is bounded: beyond maxbytes the entries of other versions
+are evicted first, then the least recently used ones.
+
+The file can be shared by several processes, e.g. the workers of a sweep.
+"""
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def canonical(x):
+    ''' Returns a canonical, repr-stable version of x for hashing: dicts are
+    sorted, arrays and NumPy scalars reduced to their contents, tariffs
+    (anything with tartype and value) to their class and attributes'''
+    if isinstance(x, dict):
+        return tuple(sorted((str(k), canonical(v)) for k, v in x.items()))
+    elif isinstance(x, (list, tuple)):
+        return tuple(canonical(v) for v in x)
+    elif isinstance(x, np.ndarray):
+        return ('ndarray', x.dtype.str, x.shape, hashlib.sha256(np.ascontiguousarray(x).tobytes()).hexdigest())
+    elif isinstance(x, np.generic):
+        return x.item()
+    elif hasattr(x, 'tartype') and hasattr(x, 'value'):
+        return (type(x).__name__, canonical(vars(x)))
+    return x
+
+
+def digest(*parts):
+    ''' Returns the sha256 hex digest of the canonical form of parts'''
+    return hashlib.sha256(repr(canonical(parts)).encode()).hexdigest()
+
+
+class DiskCache():
+    ''' SQLite backed cache with LRU eviction beyond maxbytes of pickled values.
+    version: entries stored under any other version are never returned, and
+    evicted before the entries of this version'''
+
+    def __init__(self, path, version='', maxbytes=64 * 2**20):
+        self.path = Path(path)
+        self.version = version
+        self.maxbytes = maxbytes
+        self.hits = self.misses = 0
+        self._conn = None
+        self._pid = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connect()
+
+    def _connect(self):
+        # one connection per process, connections do not survive a fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                               "key TEXT, version TEXT, value BLOB, "
+                               "size INTEGER, atime REAL, PRIMARY KEY (key, version))")
+        return self._conn
+
+    def get(self, key, default=None):
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM entries WHERE key = ? AND version = ?",
+                           (key, self.version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        conn.execute("UPDATE entries SET atime = ? WHERE key = ? AND version = ?",
+                     (time.time(), key, self.version))
+        conn.commit()
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                     (key, self.version, blob, len(blob), time.time()))
+        self._evict(conn)
+        conn.commit()
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.maxbytes:
+            return
+        # drop the entries of other versions, then the least recently used
+        # ones, down to 90% of maxbytes
+        excess = total - 0.9*self.maxbytes
+        rows = conn.execute("SELECT key, version, size FROM entries "
+                            "ORDER BY version = ?, atime", (self.version,)).fetchall()
+        drop = []
+        for key, version, size in rows:
+            if excess <= 0:
+                break
+            drop.append((key, version))
+            excess -= size
+        conn.executemany("DELETE FROM entries WHERE key = ? AND version = ?", drop)
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM entries")
+        conn.commit()
+        self.hits = self.misses = 0
+
+    def info(self):
+        conn = self._connect()
+        n, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'size': n,
+                'bytes': size, 'maxbytes': self.maxbytes, 'version': self.version}
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
@@ -1,31 +1,57 @@
 # init.py
-''' Read init.json and provides constants to other modules 
-Creates output subdirectories if theuy do not already exist'''
+''' Read init.json and provides constants to other modules
+The constants PARPATH, PARFILE, TEXTPATH and FIGPATH are read on first access,
+importing this module does no I/O.
+make_dirs() creates the output subdirectories if they do not already exist'''
 
 from pathlib import Path
 import json
+import sys
 
-PARPATH = Path(Path(__file__).parent) /"params"
 initfile = Path(Path(__file__).parent) /"init.json"
 
-try: 
-        with open(initfile, 'r') as openfile:
-        # Reading from json file
-            json_dict = json.load(openfile)
-            PARPATH = Path(Path(__file__).parent) / json_dict["PARPATH"]
-            PARFILE = PARPATH / json_dict["PARFILE"]
-            TEXTPATH = Path(Path(__file__).parent) / json_dict["TEXTPATH"]
-            FIGPATH  = Path(Path(__file__).parent) / json_dict["FIGPATH"]
-
-            print(f"****** Sucessfully read {initfile}")
-            
-          
-except FileNotFoundError:
-        print(f"*** OOPS: {initfile} not found.\nReverting to defaults.")
-        PARFILE = PARPATH / "params_default.json"
-
-print(f"****** Parameter file = {PARFILE}")
-
-for p in [TEXTPATH, FIGPATH]:
-        if not p.exists():
-                p.mkdir()
\ No newline at end of file
+_consts = {}
+
+def read_init():
+    ''' reads init.json, reverting to defaults if it is not found'''
+    PARPATH = Path(Path(__file__).parent) /"params"
+    TEXTPATH = Path(Path(__file__).parent) / "text"
+    FIGPATH = Path(Path(__file__).parent) / "figures"
+    try:
+            with open(initfile, 'r') as openfile:
+            # Reading from json file
+                json_dict = json.load(openfile)
+                PARPATH = Path(Path(__file__).parent) / json_dict["PARPATH"]
+                PARFILE = PARPATH / json_dict["PARFILE"]
+                TEXTPATH = Path(Path(__file__).parent) / json_dict["TEXTPATH"]
+                FIGPATH  = Path(Path(__file__).parent) / json_dict["FIGPATH"]
+
+                print(f"****** Sucessfully read {initfile}")
+
+
+    except FileNotFoundError:
+            print(f"*** OOPS: {initfile} not found.\nReverting to defaults.")
+            PARFILE = PARPATH / "params_default.json"
+
+    print(f"****** Parameter file = {PARFILE}")
+
+    _consts.update(PARPATH=PARPATH, PARFILE=PARFILE,
+                   TEXTPATH=TEXTPATH, FIGPATH=FIGPATH)
+    return _consts
+
+
+def make_dirs():
+    ''' creates the output subdirectories'''
+    this = sys.modules[__name__]
+    for p in [this.TEXTPATH, this.FIGPATH]:
+            if not p.exists():
+                    p.mkdir()
+
+
+def __getattr__(name):
+    # constants are read from init.json on first access
+    if name in ["PARPATH", "PARFILE", "TEXTPATH", "FIGPATH"]:
+        if not _consts:
+            read_init()
+        return _consts[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,167 @@
+# instrument.py
+"""Opt-in instrumentation of the model: evaluation counts, solver and
+quadrature diagnostics, and time spent per phase
+
+Nothing is recorded unless a recording is active:
+
+    with instrument.recording() as stats:
+        model.trademodel(t)
+    print(stats.summary())
+    stats.failures          # solver runs that did not converge
+
+recording(hook=f) also calls f(event) for every solver, quadrature and
+phase event, with event a dict holding at least 'kind' ('solver', 'quad'
+or 'phase'). Recordings can be nested, events go to the innermost one.
+Outside a recording the instrumented functions only pay for a check of an
+empty list.
+"""
+
+import functools
+import time
+
+import numpy as np
+
+# stack of the active recordings
+_active = []
+
+def current():
+    ''' Returns the Stats of the innermost active recording, None if there is none'''
+    return _active[-1] if _active else None
+
+
+class Stats():
+    ''' Structured results of a recording
+
+    evals:   {name: [calls, points]} of homedem, homesup and expsup, where
+             points counts array elements
+    solvers: list of dicts, one per root finder or optimizer run, with
+             'name', 'success', 'nit', 'nfev', 'message' and the 'phase'
+             it ran in
+    quad:    number of numerical integrals, and the largest and summed
+             error estimates
+    timings: {phase: [calls, seconds]}, times are inclusive of nested phases
+    '''
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.evals = {}
+        self.solvers = []
+        self.quad = {'calls': 0, 'max_err': 0.0, 'sum_err': 0.0}
+        self.timings = {}
+        self._phases = []
+
+    def _emit(self, event):
+        if self.hook is not None:
+            self.hook(event)
+
+    def count(self, name, x):
+        c = self.evals.setdefault(name, [0, 0])
+        c[0] += 1
+        c[1] += np.size(x)
+
+    def solver(self, name, success, nit=None, nfev=None, message='', **info):
+        ''' Records a solver run, success can be an array of flags'''
+        success = np.asarray(success)
+        event = {'kind': 'solver', 'name': name,
+                 'phase': self._phases[-1] if self._phases else None,
+                 'success': bool(success.all()),
+                 'failed': int(success.size - np.count_nonzero(success)),
+                 'nit': None if nit is None else int(nit),
+                 'nfev': None if nfev is None else int(nfev),
+                 'message': str(message), **info}
+        self.solvers.append(event)
+        self._emit(event)
+
+    def quad_err(self, abserr, neval=None):
+        ''' Records one numerical integral with error estimate abserr'''
+        self.quad['calls'] += 1
+        self.quad['max_err'] = max(self.quad['max_err'], abserr)
+        self.quad['sum_err'] += abserr
+        self._emit({'kind': 'quad', 'abserr': abserr, 'neval': neval,
+                    'phase': self._phases[-1] if self._phases else None})
+
+    def phase_time(self, name, seconds):
+        t = self.timings.setdefault(name, [0, 0.0])
+        t[0] += 1
+        t[1] += seconds
+        self._emit({'kind': 'phase', 'name': name, 'seconds': seconds})
+
+    @property
+    def failures(self):
+        ''' the solver runs that did not converge'''
+        return [s for s in self.solvers if not s['success']]
+
+    def as_dict(self):
+        return {'evals': {k: {'calls': v[0], 'points': v[1]} for k, v in self.evals.items()},
+                'solvers': list(self.solvers),
+                'quad': dict(self.quad),
+                'timings': {k: {'calls': v[0], 'seconds': v[1]} for k, v in self.timings.items()}}
+
+    def summary(self):
+        ''' Returns a text summary of the recording'''
+        lines = ["Evaluations (calls, points):"]
+        lines += [f"\t{k:<20}{c:>10d}{n:>10d}" for k, (c, n) in self.evals.items()]
+        lines.append("Solvers (runs, iterations, function evaluations, failures):")
+        names = sorted({s['name'] for s in self.solvers})
+        for name in names:
+            runs = [s for s in self.solvers if s['name'] == name]
+            nit = sum(s['nit'] or 0 for s in runs)
+            nfev = sum(s['nfev'] or 0 for s in runs)
+            fails = sum(not s['success'] for s in runs)
+            lines.append(f"\t{name:<20}{len(runs):>10d}{nit:>10d}{nfev:>10d}{fails:>10d}")
+        lines.append(f"Quadrature: {self.quad['calls']} integrals, "
+                     f"max error estimate {self.quad['max_err']:.3g}")
+        lines.append("Timings (calls, seconds):")
+        lines += [f"\t{k:<20}{c:>10d}{s:>10.4f}" for k, (c, s) in self.timings.items()]
+        return "\n".join(lines)
+
+
+class recording():
+    ''' Context manager activating a recording, yields its Stats'''
+
+    def __init__(self, hook=None):
+        self.stats = Stats(hook)
+
+    def __enter__(self):
+        _active.append(self.stats)
+        return self.stats
+
+    def __exit__(self, *exc):
+        _active.remove(self.stats)
+        return False
+
+
+################################################################
+# decorators for the instrumented functions
+################################################################
+
+def counted(method):
+    ''' Decorator counting the calls of method(self, p, ...) and the points p'''
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, p, *args, **kwargs):
+        if _active:
+            _active[-1].count(name, p)
+        return method(self, p, *args, **kwargs)
+    return wrapper
+
+
+def timed(method):
+    ''' Decorator timing a phase of the model: solver events raised
+    while it runs are tagged with its name'''
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if not _active:
+            return method(*args, **kwargs)
+        stats = _active[-1]
+        stats._phases.append(name)
+        t0 = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stats._phases.pop()
+            stats.phase_time(name, time.perf_counter() - t0)
+    return wrapper
@@ -1,3 +1,6 @@
+from collections import OrderedDict
+import numpy as np
+
 
 def pretty_print(x, fw= 10, dig= 2, indent=1):
       """ Pretty printing dicts, lists and tuples"""
@@ -78,3 +81,55 @@ def set_unit(unit):
         func.unit = unit
         return func
     return decorator_set_unit
+
+
+# bounded cache with least-recently-used eviction
+
+class LRUCache():
+    """Dict-like cache holding at most maxsize items.
+    When full, the least recently used item is evicted"""
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.data), 'maxsize': self.maxsize}
+
+
+def freeze(x):
+    """Returns a hashable version of nested dicts, lists and arrays"""
+    if isinstance(x, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in x.items()))
+    elif isinstance(x, (list, tuple, np.ndarray)):
+        return tuple(freeze(v) for v in x)
+    else:
+        return x
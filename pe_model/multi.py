@@ -0,0 +1,249 @@
+# multi.py
+"""Large country model with many foreign suppliers and discriminatory tariffs
+
+Each foreign supplier (partner) i has its own export supply parameters and its
+own tariff, so that preferential agreements and trade diversion can be
+modelled. The home market clears when
+
+    impdem(p) = sum_i expsup_i(p, t_i)
+
+The partners are held as arrays of supply parameters (const, slope) and of
+tariff wedges (a, s): partner i receives p*(1-a_i) - s_i (see
+pe_model.tar_wedge). Clearing the market thus costs a few array operations
+per iteration, whatever the number of partners.
+
+Parameters are as in the parameter files, with the single forsup_pars,
+TAR_type and TAR_val replaced by a list of partners, e.g.
+
+    "partners": [{"name": "EU", "forsup_pars": {"const": 5.0, "slope": 0.9},
+                  "TAR_type": "Ave", "TAR_val": 0.0},
+                 {"name": "ROW", "forsup_pars": {"const": 3.0, "slope": 1.2},
+                  "TAR_type": "Ave", "TAR_val": 0.2}]
+
+Partners without TAR_type and TAR_val face no tariff.
+"""
+
+import numpy as np
+
+import pe_model as mod
+import tariffs as tars
+from basefuncs import f_int
+from kitchen import pretty_print, freeze
+
+
+class MultiTradeModel():
+    ''' The large country PE model with N foreign suppliers.
+
+    params: dict as described in the module docstring. Missing home market
+            parameters are taken from pe_model.DEFAULTS.
+
+    Tariffs t in the methods below can be given as:
+        None: the tariffs in params
+        a list of N tariffs (Tariff instances or 0), one per partner
+        a single Tariff (or 0): the same (MFN) tariff for all partners
+        a tariffs.TariffSchedule with one line per partner
+        a pair of arrays (a, s) of ad-valorem and specific parts,
+        broadcastable to (..., N), e.g. (K, N) to solve K tariff scenarios at once
+    As in TradeModel, linear supply is not truncated at zero.
+    '''
+
+    def __init__(self, params):
+        params = {**mod.DEFAULTS, **params}
+        partners = params["partners"]
+        # home market, its forsup_pars are not used
+        self.home = mod.TradeModel(params)
+        self.SYSTEM, self.f = self.home.SYSTEM, self.home.f
+        self.MONEY, self.VOLUME = self.home.MONEY, self.home.VOLUME
+
+        self.names = tuple(p.get("name", f"partner {i}") for i, p in enumerate(partners))
+        self.N = len(partners)
+        self.forsup_pars = {k: self._frozen([p["forsup_pars"][k] for p in partners])
+                            for k in ["const", "slope"]}
+        a, s = zip(*[mod.tar_wedge(mod.create_tar_instance(p.get("TAR_type"), p.get("TAR_val", 0.0)))
+                     for p in partners])
+        self.a, self.s = self._frozen(a), self._frozen(s)
+
+    @staticmethod
+    def _frozen(values):
+        arr = np.array(values, dtype=float)
+        arr.setflags(write=False)
+        return arr
+
+    @property
+    def key(self):
+        ''' hashable key of the parameters, used by the cache'''
+        return ('multi', self.home.key[:3], freeze(self.forsup_pars))
+
+    def __repr__(self):
+        return f"MultiTradeModel(SYSTEM={self.SYSTEM}, partners={list(self.names)})"
+
+    ################################################################
+    # define equations
+    ################################################################
+
+    def homedem(self, p):
+        return self.home.homedem(p)
+
+    def homesup(self, p):
+        return self.home.homesup(p)
+
+    def impdem(self, p):
+        return self.home.impdem(p)
+
+    def home_notrade_equil(self):
+        return self.home.home_notrade_equil()
+
+    def wedges(self, t=None):
+        ''' Returns the arrays (a, s) of ad-valorem and specific parts of the
+        partners' tariffs t, see the class docstring'''
+        if t is None:
+            return self.a, self.s
+        if isinstance(t, tars.TariffSchedule):
+            return t.wedges()
+        if isinstance(t, tuple):
+            a, s = t
+            return np.asarray(a, dtype=float), np.asarray(s, dtype=float)
+        if isinstance(t, list):
+            if len(t) != self.N:
+                raise ValueError(f"Expected {self.N} tariffs, got {len(t)}")
+            a, s = zip(*[mod.tar_wedge(ti) for ti in t])
+            return np.array(a, dtype=float), np.array(s, dtype=float)
+        a, s = mod.tar_wedge(t)
+        return np.full(self.N, a), np.full(self.N, s)
+
+    def expsup_i(self, p, t=None):
+        ''' Returns the export supply of each partner, shaped p.shape + (N,),
+        as function of the tariff-inclusive price p and tariffs t'''
+        a, s = self.wedges(t)
+        px = np.asarray(p, dtype=float)[..., None]*(1. - a) - s
+        return self.f(px, **self.forsup_pars)
+
+    def expsup(self, p, t=None):
+        ''' Returns total foreign supply as function of p and tariffs t'''
+        return np.sum(self.expsup_i(p, t), axis=-1)
+
+    ################################################################
+    # solution
+    ################################################################
+
+    def equil_price(self, t=None):
+        ''' Returns the tariff-inclusive price that clears
+        impdem(p) = sum_i expsup_i(p, t_i), shaped like the broadcast
+        tariff wedges without their last (partner) axis.
+        Closed form for SYSTEM 'lin':
+        p = (cd - cs - sum_i(c_i - b_i*s_i)) / (bs - bd + sum_i b_i*(1-a_i))'''
+        a, s = self.wedges(t)
+        c, b = self.forsup_pars["const"], self.forsup_pars["slope"]
+        shape = np.broadcast_shapes(a.shape, s.shape, c.shape)[:-1]
+        if self.SYSTEM == 'lin':
+            hd, hs = self.home.homedem_pars, self.home.homesup_pars
+            return ((hd["const"] - hs["const"] - np.sum(c - b*s, axis=-1))
+                    / (hs["slope"] - hd["slope"] + np.sum(b*(1. - a), axis=-1)))
+
+        def equil(p):
+            return self.impdem(p) - self.expsup(p, (a, s))
+
+        P0, _ = self.home_notrade_equil()
+        # tariffs raise the price from free trade towards autarky
+        lo = self.free_trade_equil()[0] if np.any(a) or np.any(s) else P0/2
+        p, _ = mod.solve_batch(equil, np.full(shape, lo), np.full(shape, P0))
+        return p[()]
+
+    @mod.memoize
+    def free_trade_equil(self):
+        '''Returns free trade equilibrium (world price, imports)'''
+        PW = self.equil_price(0)
+        return (PW, self.expsup(PW, 0))
+
+    def trademodel(self, t=None):
+        ''' Solves the model for tariffs t.
+
+        Returns a dict with
+            pstar_t: tariff-inclusive price on home market
+            pstar_i: price received by each exporter
+            xstar_i: export quantity of each exporter
+            share_i: share of each exporter in imports
+            mstar, dstar, sstar: imports, domestic demand and supply
+            P0, Q0: home no-trade equilibrium
+        Per-partner entries have a last axis of length N.
+        '''
+        a, s = self.wedges(t)
+        pstar_t = self.equil_price((a, s))
+
+        endo = {}
+        endo['pstar_t'] = pstar_t
+        endo['pstar_i'] = np.asarray(pstar_t)[..., None]*(1. - a) - s
+        endo['xstar_i'] = self.f(endo['pstar_i'], **self.forsup_pars)
+        endo['mstar'] = self.impdem(pstar_t)
+        endo['share_i'] = endo['xstar_i'] / np.asarray(endo['mstar'])[..., None]
+        endo['dstar'] = self.homedem(pstar_t)
+        endo['sstar'] = self.homesup(pstar_t)
+        endo['P0'], endo['Q0'] = self.home_notrade_equil()
+        return endo
+
+    ################################################################
+    # welfare calculations
+    ################################################################
+
+    def home_welf(self, p0, p_t, pstar_i):
+        ''' Returns a dict with the components of changes in domestic welfare
+        relative to p0 (typically the free trade price), as in
+        TradeModel.home_welf, with tariff revenues and terms of trade effects
+        also per partner:
+            dRev_i = (p_t - pstar_i) * xstar_i
+            ToT_i = (p0 - pstar_i) * xstar_i
+        A partner with a preferential tariff can have a negative ToT_i:
+        imports diverted to it are paid above the free trade price.
+        '''
+        # consumer and producer surplus, EV and CV only depend on the home price
+        welf = self.home.home_welf(p0, p_t, p_t)
+        x_i = self.f(pstar_i, **self.forsup_pars)
+        p_t = np.asarray(p_t)[..., None]
+
+        welf['dRev_i'] = (p_t - pstar_i) * x_i
+        welf['ToT_i'] = (p0 - pstar_i) * x_i
+        welf['dRev'] = np.sum(welf['dRev_i'], axis=-1)
+        welf['ToT'] = np.sum(welf['ToT_i'], axis=-1)
+        welf['DW'] = welf['dCS'] + welf['dPS'] + welf['dRev']
+        welf['total'] = welf['DW']
+        return welf
+
+    def foreign_welf(self, p0, pstar_i):
+        ''' Returns per partner the terms of trade effect ToT_i and
+        producer surplus change dPS_i relative to p0'''
+        welf = {}
+        welf['ToT_i'] = -(p0 - pstar_i) * self.f(pstar_i, **self.forsup_pars)
+        welf['dPS_i'] = f_int(self.f, p0, pstar_i, **self.forsup_pars)
+        return welf
+
+
+#%% Trial run: preferential agreement with the first partner
+
+def trial_run():
+    params = {"SYSTEM": "linlog",
+              "homedem_pars": {"const": 2.0, "slope": -1.5},
+              "homesup_pars": {"const": 2.0, "slope": 0.5},
+              "partners": [{"name": "A", "forsup_pars": {"const": 2.0, "slope": 0.9}},
+                           {"name": "B", "forsup_pars": {"const": 2.0, "slope": 1.5}},
+                           {"name": "C", "forsup_pars": {"const": 1.0, "slope": 2.0}}]}
+    model = MultiTradeModel(params)
+    pw, _ = model.free_trade_equil()
+    mfn = mod.create_tar_instance('Ave', 0.2)
+    scenarios = {'Free trade': 0,
+                 'MFN tariff 20%': mfn,
+                 'Preferential agreement with A': [0, mfn, mfn]}
+
+    print('*'*20)
+    for label, t in scenarios.items():
+        eq = model.trademodel(t)
+        welf = model.home_welf(pw, eq['pstar_t'], eq['pstar_i'])
+        res = {'pstar_t': eq['pstar_t'], 'mstar': eq['mstar'], 'total welfare': welf['total']}
+        res.update({f'imports {n}': x for n, x in zip(model.names, eq['xstar_i'])})
+        res.update({f'ToT {n}': x for n, x in zip(model.names, welf['ToT_i'])})
+        res = {k: round(float(v), 3) for k, v in res.items()}
+        print(f"{label}\n{pretty_print(res, fw=16, dig=3, indent=1)}")
+    print('*'*20)
+
+
+if __name__ == '__main__':
+    trial_run()
@@ -16,21 +16,28 @@ FvT February 2025
 import numpy as np
 from pathlib import Path
 import json
-
-# import scipy modules for root finding and integration
-from scipy import optimize
-from scipy.integrate import quad
+import copy
+import functools
+import hashlib
+from types import MappingProxyType
 
 # local imports
 from basefuncs import * # linfunc, linlogfunc, f_inv, funcs
-import tariffs as tars 
-from kitchen import pretty_print, set_unit
+from solvers import bracket, illinois, newton, brent, SolverError
+import tariffs as tars
+from kitchen import pretty_print, set_unit, LRUCache, freeze
+import instrument
+from diskcache import DiskCache, digest
+from instrument import counted, timed
 import init
 
-PARPATH = init.PARPATH
-PARFILE = init.PARFILE   
-TEXTPATH = init.TEXTPATH
-FIGPATH = init.FIGPATH
+# NOTE: importing this module does no I/O, no solving and no printing.
+# init.json and PARFILE are read on first use of one of the names in _LAZY
+# (see load_params), scipy is only imported by the functions that need it.
+# Run this file as a script for the trial run of the model.
+_LAZY = ["PARPATH", "PARFILE", "TEXTPATH", "FIGPATH", "params_dict",
+         "SYSTEM", "MONEY", "VOLUME", "TAR_type", "TAR_val",
+         "homedem_pars", "homesup_pars", "forsup_pars", "f"]
 
 #############################################################
 # INITIALIZE
@@ -54,14 +61,9 @@ DEFAULTS = {
             "forsup_pars": {"const": -2,
                             "slope": 15}
         }
-SYSTEM = DEFAULTS["SYSTEM"]
-MONEY, VOLUME = DEFAULTS["MONEY"], DEFAULTS["VOLUME"]
-TAR_type, TAR_val = DEFAULTS["TAR_type"], DEFAULTS["TAR_val"]
-homedem_pars, homesup_pars = DEFAULTS["homedem_pars"], DEFAULTS["homesup_pars"]
-forsup_pars = DEFAULTS["forsup_pars"]
 
 
-# read parameter file         
+# read parameter file
 def read_parfile(fname):
     ''' reads params from json file'''
     try: 
@@ -75,31 +77,57 @@ def read_parfile(fname):
         params_dict = DEFAULTS
     return params_dict
 
-params_dict= read_parfile(PARPATH/ PARFILE)
-#unpacks parameters dict
-validkeys = ["SYSTEM", "MONEY", "VOLUME",
-                 "TAR_type","TAR_val", 
-                 "homedem_pars", "homesup_pars", "forsup_pars" 
-                ]
-try:
-    SYSTEM = params_dict["SYSTEM"]
-    MONEY, VOLUME = params_dict["MONEY"], params_dict["VOLUME"]
-    TAR_type, TAR_val = params_dict["TAR_type"], params_dict["TAR_val"]
-    homedem_pars, homesup_pars = params_dict["homedem_pars"], params_dict["homesup_pars"]
-    forsup_pars = params_dict["forsup_pars"]
-    
-except KeyError:
-    print(f"*** OOPS: necessary variable not found in {PARFILE}.\n"
-                   f"Reverting to DEFAULTS.")
-    
-    SYSTEM = DEFAULTS["SYSTEM"]
-    MONEY, VOLUME = DEFAULTS["MONEY"], DEFAULTS["VOLUME"]
-    TAR_type, TAR_val = DEFAULTS["TAR_type"], DEFAULTS["TAR_val"]
-    homedem_pars, homesup_pars = DEFAULTS["homedem_pars"], DEFAULTS["homesup_pars"]
-    forsup_pars = DEFAULTS["forsup_pars"]
-
-
-f = funcs[SYSTEM]['f']
+_loaded = False
+
+def load_params(fname=None):
+    ''' Reads the parameter file fname (defaults to PARFILE of init.json) and
+    sets the module level parameters. Runs on first use of any of them'''
+    global _loaded, PARPATH, PARFILE, TEXTPATH, FIGPATH, params_dict
+    global SYSTEM, MONEY, VOLUME, TAR_type, TAR_val
+    global homedem_pars, homesup_pars, forsup_pars, f
+
+    PARPATH, PARFILE = init.PARPATH, init.PARFILE
+    TEXTPATH, FIGPATH = init.TEXTPATH, init.FIGPATH
+    if fname is not None:
+        PARFILE = Path(fname)
+
+    params_dict= read_parfile(PARPATH/ PARFILE)
+    #unpacks parameters dict
+    validkeys = ["SYSTEM", "MONEY", "VOLUME",
+                     "TAR_type","TAR_val",
+                     "homedem_pars", "homesup_pars", "forsup_pars"
+                    ]
+    try:
+        SYSTEM = params_dict["SYSTEM"]
+        MONEY, VOLUME = params_dict["MONEY"], params_dict["VOLUME"]
+        TAR_type, TAR_val = params_dict["TAR_type"], params_dict["TAR_val"]
+        homedem_pars, homesup_pars = params_dict["homedem_pars"], params_dict["homesup_pars"]
+        forsup_pars = params_dict["forsup_pars"]
+
+    except KeyError:
+        print(f"*** OOPS: necessary variable not found in {PARFILE}.\n"
+                       f"Reverting to DEFAULTS.")
+
+        SYSTEM = DEFAULTS["SYSTEM"]
+        MONEY, VOLUME = DEFAULTS["MONEY"], DEFAULTS["VOLUME"]
+        TAR_type, TAR_val = DEFAULTS["TAR_type"], DEFAULTS["TAR_val"]
+        homedem_pars, homesup_pars = DEFAULTS["homedem_pars"], DEFAULTS["homesup_pars"]
+        forsup_pars = DEFAULTS["forsup_pars"]
+
+    f = funcs[SYSTEM]['f']
+
+    homedem.unit = VOLUME
+    home_welf.unit = MONEY
+    _loaded = True
+    return params_dict
+
+
+def __getattr__(name):
+    # the module level parameters are read on first access
+    if name in _LAZY and not _loaded:
+        load_params()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 ################################################################
 # helper functions
@@ -114,250 +142,819 @@ def create_tar_instance(type, val):
         t = 0.0     
     return t
 
-def solve(func, init):
-    # solves by searching root of function
-    sol = optimize.root(func, x0=init)
-    return sol
+def solve(func, lo, hi, xtol=1e-15, maxiter=100):
+    ''' Returns the root of the scalar equilibrium condition func(p), 
+    decreasing in the price p > 0. 
+    [lo, hi] is widened by bracket() until func changes sign on it, 
+    typically from the free trade and autarky prices, and the root is
+    then found by Brent's method, which never leaves the bracket.
+    Raises SolverError if there is no sign change, or no convergence 
+    within maxiter iterations. 
+    The default xtol leaves the precision to Brent's relative tolerance 
+    (4 machine epsilon): find_optimal_tariff() needs a smooth welfare'''
+    lo, hi, flo, fhi = [float(v) for v in bracket(func, lo, hi)]
+    if not (np.isfinite(flo) and np.isfinite(fhi) and flo*fhi <= 0):
+        raise SolverError(f"Equilibrium condition does not change sign for prices "
+                          f"in [{lo:.6g}, {hi:.6g}]: f = {flo:.6g}, {fhi:.6g}")
+    p, nit, converged = brent(func, lo, hi, flo, fhi, xtol=xtol, maxiter=maxiter)
+    stats = instrument.current()
+    if stats is not None:
+        stats.solver('brent', converged, nit=nit)
+    if not converged:
+        raise SolverError(f"Brent's method did not converge in {maxiter} iterations, "
+                          f"last price {p:.6g} in [{lo:.6g}, {hi:.6g}]")
+    return p
+
+def solve_batch(func, lo, hi, xtol=1e-12, maxiter=100, failed='raise'):
+    ''' Returns the roots of the equilibrium conditions func(p), element-wise
+    on arrays, and the number of iterations: the vectorized counterpart of
+    solve(). [lo, hi] is widened by bracket() and the roots are found by 
+    illinois(). Elements without a sign change or without convergence raise 
+    SolverError, or with failed='nan' are nan (e.g. Monte Carlo draws, which 
+    are dropped then)'''
+    lo, hi, flo, fhi = bracket(func, lo, hi)
+    p, nit, converged = illinois(func, lo, hi, flo, fhi, xtol=xtol, maxiter=maxiter)
+    converged = converged & np.isfinite(flo) & np.isfinite(fhi) & (flo*fhi <= 0)
+    stats = instrument.current()
+    if stats is not None:
+        stats.solver('illinois', converged, nit=nit)
+    if not np.all(converged):
+        if failed != 'nan':
+            raise SolverError(f"No equilibrium found for {np.size(p) - np.count_nonzero(converged)} "
+                              f"of {np.size(p)} elements within {maxiter} iterations")
+        p = np.where(converged, p, np.nan)
+    return p, nit
+
+def tar_wedge(t):
+    ''' Returns the ad-valorem and specific parts (a, s) of tariff t, 
+    such that the price received by the exporter is p*(1-a) - s.
+    Arrays of the lines for a TariffSchedule'''
+    if isinstance(t, tars.TariffSchedule):
+        return t.wedges()
+    elif isinstance(t, tars.Ave):
+        return t.value, 0.0
+    elif isinstance(t, tars.Specific):
+        return 0.0, t.value
+    else:
+        return 0.0, 0.0
 
 ################################################################
-# define equations
+# cache of tariff-independent results
 ################################################################
 
-@set_unit(VOLUME)
-def homedem(p, pars=homedem_pars):
-    ''' Returns domestic demand quantity as function of price p'''
-    return f(p, **pars)
+# results that only depend on the parameters, e.g. the autarky and free trade
+# equilibria. Keys include the parameters, so changing any of them
+# invalidates the cached values automatically
+CACHE = LRUCache(maxsize=128)
+
+def parkey():
+    ''' Returns a hashable key of the current model parameters'''
+    if not _loaded:
+        load_params()
+    return (SYSTEM, freeze(homedem_pars), freeze(homesup_pars), freeze(forsup_pars))
+
+def memoize(method):
+    ''' Decorator caching the result of a tariff-independent TradeModel method
+    in CACHE. Its arguments, if any, must be hashable. 
+    Returns copies of mutable results'''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, self.key, args, tuple(sorted(kwargs.items())))
+        res = CACHE.get(key)
+        if res is None:
+            res = method(self, *args, **kwargs)
+            CACHE.put(key, res)
+        return copy.deepcopy(res) if isinstance(res, dict) else res
+    return wrapper
+
+def clear_cache():
+    CACHE.clear()
 
+################################################################
+# persistent cache of results across runs, off by default
+################################################################
 
-def homesup(p, pars=homesup_pars):
-    ''' Returns domestic supply quantity as function of price p'''
-    return f(p, **pars)
+DISK_CACHE = None
+
+def code_version():
+    ''' Returns a hash of the source of the modules that compute results'''
+    h = hashlib.sha256()
+    for name in ['pe_model.py', 'basefuncs.py', 'solvers.py', 'tariffs.py']:
+        h.update((Path(__file__).parent / name).read_bytes())
+    return h.hexdigest()[:16]
+
+def use_disk_cache(path=None, maxbytes=64 * 2**20):
+    ''' Stores the results of trademodel, trademodel_batch, trademodel_path,
+    home_welf and foreign_welf in the SQLite file path (see diskcache.py), 
+    so that scenarios run before become lookups, also across runs.
+    Entries of other versions of the code are never returned, and evicted first.
+    path=None switches the cache off. Returns the DiskCache'''
+    global DISK_CACHE
+    if DISK_CACHE is not None:
+        DISK_CACHE.close()
+    DISK_CACHE = None if path is None else DiskCache(path, code_version(), maxbytes)
+    return DISK_CACHE
+
+def persist(method):
+    ''' Decorator storing the results of a TradeModel method in DISK_CACHE, 
+    keyed by the functions, parameters and units of the model and the 
+    arguments of the call'''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if DISK_CACHE is None:
+            return method(self, *args, **kwargs)
+        key = digest(method.__name__, self.key, self.MONEY, self.VOLUME, args, kwargs)
+        res = DISK_CACHE.get(key)
+        if res is None:
+            res = method(self, *args, **kwargs)
+            DISK_CACHE.put(key, res)
+        return res
+    return wrapper
 
-def impdem(p):
-    '''returns demand for imports as function of price'''
 
-    return homedem(p) - homesup(p)
+###########################################################################
+# The PE model
+###########################################################################
 
+class TradeModel():
+    ''' The large country PE model for one set of parameters.
 
-def expsup(p, t:tars.Tariff, pars=forsup_pars):
-    ''' Returns foreign supply quantity as function of 
-    price p and tariff t'''
-    if isinstance(t, tars.Tariff):
-        p_tar = p*(1. - t.ave(p))
-        
+    params: dict as read from a parameter file, see DEFAULTS.
+            Missing keys are taken from DEFAULTS.
+
+    The parameters are frozen when the model is created: the parameter dicts
+    are read-only and a different parameter set needs a new TradeModel.
+    Models carry no global state, so any number of them can be used side by side.
+    '''
+
+    def __init__(self, params=None):
+        params = DEFAULTS if params is None else {**DEFAULTS, **params}
+        self.SYSTEM = params["SYSTEM"]
+        self.MONEY, self.VOLUME = params["MONEY"], params["VOLUME"]
+        self.TAR_type, self.TAR_val = params["TAR_type"], params["TAR_val"]
+        self.homedem_pars = MappingProxyType(dict(params["homedem_pars"]))
+        self.homesup_pars = MappingProxyType(dict(params["homesup_pars"]))
+        self.forsup_pars = MappingProxyType(dict(params["forsup_pars"]))
+        self.f = funcs[self.SYSTEM]['f']
+
+    @functools.cached_property
+    def key(self):
+        ''' hashable key of the parameters, used by the cache'''
+        return (self.SYSTEM, freeze(dict(self.homedem_pars)),
+                freeze(dict(self.homesup_pars)), freeze(dict(self.forsup_pars)))
+
+    def __repr__(self):
+        return (f"TradeModel(SYSTEM={self.SYSTEM}, homedem_pars={dict(self.homedem_pars)}, "
+                f"homesup_pars={dict(self.homesup_pars)}, forsup_pars={dict(self.forsup_pars)})")
+
+    ################################################################
+    # define equations
+    ################################################################
+
+    @counted
+    def homedem(self, p):
+        ''' Returns domestic demand quantity as function of price p'''
+        return self.f(p, **self.homedem_pars)
+
+    @counted
+    def homesup(self, p):
+        ''' Returns domestic supply quantity as function of price p'''
+        return self.f(p, **self.homesup_pars)
+
+    def impdem(self, p):
+        '''returns demand for imports as function of price'''
+        return self.homedem(p) - self.homesup(p)
+
+    @counted
+    def expsup(self, p, t:tars.Tariff):
+        ''' Returns foreign supply quantity as function of
+        price p and tariff t'''
+        if isinstance(t, tars.Tariff):
+            p_tar = p*(1. - t.ave(p))
+        else:
+            p_tar  = p
+
+        return self.f(p_tar , **self.forsup_pars)
+
+    def expprice(self, x):
+        '''Inverse of expsup(p) returns foreign export price as function of
+        export volume x'''
+        # without tariff, expsup is f with the foreign supply parameters
+        return f_inv(self.f, exo=x, **self.forsup_pars)
+
+    @timed
+    @memoize
+    def home_notrade_equil(self):
+        '''Returns no trade equilibrium in home market, i.e when
+            domestic demand equals domestic supply and hence impdem(p) = 0.
+             Solves the intersection of D-S analytically in the linear
+             system and numerically otherwise'''
+
+        if self.SYSTEM == 'lin':
+            hd, hs = self.homedem_pars, self.homesup_pars
+            p = (hd["const"] - hs["const"]) / (hs["slope"] - hd["slope"])
+            return (p, self.homedem(p))
+
+        # no price is known yet: bracket() widens the initial bracket as needed
+        p = solve(self.impdem, 0.5, 2.)
+        return (p, self.homedem(p))
+
+    def lin_equil_price(self, t):
+        ''' Closed-form tariff-inclusive price that clears impdem(p) = expsup(p, t)
+        when SYSTEM == 'lin'.
+        With the exporter receiving p*(1-a) - s (see tar_wedge):
+        p = (cd - cs - cf + bf*s) / (bs - bd + bf*(1-a))
+        where c are the constants and b the slopes. Works on tariff arrays.'''
+
+        a, s = tar_wedge(t)
+        hd, hs, fs = self.homedem_pars, self.homesup_pars, self.forsup_pars
+        return ((hd["const"] - hs["const"] - fs["const"] + fs["slope"]*s)
+                / (hs["slope"] - hd["slope"] + fs["slope"]*(1. - a)))
+
+    @timed
+    @memoize
+    def free_trade_equil(self):
+        '''Returns free trade equilibrium (world price, imports)'''
+        if self.SYSTEM == 'lin':
+            PW = self.lin_equil_price(t=0)
+        else:
+            def equil(p):
+                return self.impdem(p) - self.expsup(p, t=0)
+            # imports are positive below the autarky price
+            P0, _ = self.home_notrade_equil()
+            PW = solve(equil, P0/2, P0)
+        return (PW, self.expsup(PW, t=0))
+
+    #%% generate results
+
+    @timed
+    @memoize
+    def generate_markets(self, numdat=20, adaptive=False):
+        '''generate some data to plot the demand and supply functions.
+
+        numdat: number of prices at which the curves are evaluated
+        adaptive: if True, the prices are spread according to how much the
+                  curves bend, rather than evenly: straight stretches get
+                  fewer points, bends more. 
+        Returns a dict with arrays p, d, s, m and x (prices and the curves),
+        and the free trade solution pw, m1, s1 and d1
+        '''
+
+        res = {'p':[], 'd':[], 's':[],'x':[], 'm':[], 'pw':0.0, 'm1':0.0}
+
+        # find suitable range of prices to plot
+        P0, Q0 = self.home_notrade_equil()
+
+        # free trade equilibrium
+        PW, m1 = self.free_trade_equil()
+
+        alfa = 4 # ratio of largest and midpoint on home quantity axis
+        beta = 3 # ratio of largest and midpoint on world quantity axis
+
+        P1 = f_inv(self.f, Q0*alfa, **self.homedem_pars)
+        P2 = f_inv(self.f, Q0/alfa, **self.homedem_pars)
+        P3, P4 = self.expprice(m1/beta), self.expprice(m1*beta)
+
+        # finally, this is the price range that should work (mostly)
+        start, stop = max(min(P1,P3),1e-3), max(min(P2, P4),1e-3)
+
+        if adaptive:
+            p = self.adaptive_prices(start, stop, numdat)
+        else:
+            p = np.linspace(start, stop, numdat)
+        res['p'] = p
+        res['d'] = self.homedem(p)
+        res['s'] = self.homesup(p)
+        res['m'] = res['d'] - res['s']
+        res['x'] = self.expsup(p, t=0)
+
+        res['pw'] = PW
+        res['m1'] = self.expsup(res['pw'], t=0)
+        res['s1'] = self.homesup(res['pw'])
+        res['d1'] = self.homedem(res['pw'])
+
+        return res
+
+    def adaptive_prices(self, start, stop, numdat, refine=8):
+        ''' Returns numdat prices from start to stop, spread so that
+        half of them are even and half follow the bending of the demand, 
+        supply, import and export curves: the square root of their largest
+        second difference (relative to their range) on a pilot grid of
+        refine*numdat prices'''
+        pf = np.linspace(start, stop, refine*numdat)
+        d, s = self.homedem(pf), self.homesup(pf)
+        q = np.vstack([d, s, d - s, self.expsup(pf, t=0)])
+        span = np.ptp(q, axis=1, keepdims=True)
+        q = q / np.where(span > 0, span, 1.)
+        bend = np.pad(np.abs(np.diff(q, 2, axis=1)).max(axis=0), 1, mode='edge')
+        bend = np.where(bend > 1e-9, bend, 0.)          # straight up to rounding
+        dens = np.sqrt(0.5*(bend[:-1] + bend[1:]))      # per interval of pf
+        dens = dens + dens.mean() if dens.mean() > 0 else np.ones_like(dens)
+        cdf = np.concatenate([[0.], np.cumsum(dens)])
+        return np.interp(np.linspace(0., cdf[-1], numdat), cdf, pf)
+
+    @timed
+    @persist
+    def trademodel(self, tariff:tars.Tariff, **kwargs):
+        ''' The equations and solution of the model '''
+
+        exog = {'tariff': tariff.value}
+
+        endo = {'pstar_t': 0.0,
+                'pstar': 0.0,
+                'mstar': 0.0,
+                'xstar': 0.0,
+                'dstar': 0.0,
+                'sstar': 0.0,
+                'P0':0,
+                'Q0':0}
+
+        desc = {'pstar_t': 'tariff-inclusive price on home market',
+                'pstar': 'price received by exporter',
+                'mstar': 'import quantity',
+                'xstar': 'export quantity',
+                'dstar': 'domestic demand quantity',
+                'sstar': 'domestic supply quantity',
+                'tariff': str(tariff),
+                'P0': f'Price at home no-trade equilibrium ({self.MONEY})',
+                'Q0': f'Quantity at home no-trade equilibrium ({self.VOLUME})',
+                }
+        if kwargs:
+            for k, v in kwargs.items():
+                desc[k] = v
+
+        t = tariff
+
+        '''Equilibrium condition
+        It clears domestic and foreign markets:
+        M(p) = D(p) - S(p)
+        M(p) = X(p,t)
+        so that (D - S - X) = 0 yields the tariff-ridden price.
+          Solves numerically'
+        '''
+        def equil(p):                           # eqilibrium condition
+            return self.impdem(p) - self.expsup(p, t)
+
+        if self.SYSTEM == 'lin':
+            pstar_t = self.lin_equil_price(t)  # closed form, no solving needed
+        else:
+            # a tariff raises the home price from free trade towards autarky
+            PW, _ = self.free_trade_equil()
+            P0, _ = self.home_notrade_equil()
+            pstar_t = solve(equil, PW, P0)     # equilibrium tariff-inclusive price
+        xstar = self.expsup(pstar_t, t=t)      # export quantity
+
+        endo['pstar_t'] = pstar_t
+        endo['xstar'] = xstar
+        endo['pstar'] = self.expprice(xstar)   # price received by exporter
+        endo['mstar'] = self.impdem(pstar_t)   # imports
+        endo['dstar'] = self.homedem(pstar_t)  # doemstic demand
+        endo['sstar'] = self.homesup(pstar_t)  # domestic supply
+
+        endo['P0'], endo['Q0'] = self.home_notrade_equil() # autarky solution
+
+        return endo, desc
+
+    @timed
+    @persist
+    def trademodel_batch(self, tariffs, tartype=None):
+        ''' Solves the model for a whole array of tariff values in one go.
+
+        tariffs: array of tariff values, all of type tartype ('Ave' or 'Specific',
+                 defaults to TAR_type), or a tars.TariffSchedule of mixed lines
+
+        Returns a dict with the keys of trademodel()'s endo, holding arrays
+        shaped like tariffs (P0 and Q0 are scalars)
+        '''
+        if isinstance(tariffs, tars.TariffSchedule):
+            t, tariffs = tariffs, tariffs.value
+        else:
+            tartype = self.TAR_type if tartype is None else tartype
+            tariffs = np.asarray(tariffs, dtype=float)
+            t = create_tar_instance(tartype, tariffs)
+            if not isinstance(t, tars.Tariff):
+                raise ValueError(f"Unknown tariff type: {tartype}")
+
+        def equil(p):                           # eqilibrium condition
+            return self.impdem(p) - self.expsup(p, t)
+
+        P0, Q0 = self.home_notrade_equil()
+        if self.SYSTEM == 'lin':
+            pstar_t = self.lin_equil_price(t)
+        else:
+            # as in trademodel, between the free trade and autarky prices
+            PW, _ = self.free_trade_equil()
+            pstar_t, _ = solve_batch(equil, np.full(tariffs.shape, PW),
+                                     np.full(tariffs.shape, P0))
+
+        endo = {}
+        endo['pstar_t'] = pstar_t
+        endo['xstar'] = self.expsup(pstar_t, t)
+        # as in trademodel, also beyond the prohibitive tariff, where
+        # pstar_t*(1 - ave) would turn negative
+        endo['pstar'] = self.expprice(endo['xstar'])
+        endo['mstar'] = self.impdem(pstar_t)
+        endo['dstar'] = self.homedem(pstar_t)
+        endo['sstar'] = self.homesup(pstar_t)
+        endo['P0'], endo['Q0'] = P0, Q0
+
+        return endo
+
+    def equil_derivs(self, p, t):
+        ''' Returns the excess import demand g(p, t) = impdem(p) - expsup(p, t)
+        and its partial derivatives g_p and g_t (with respect to the tariff
+        value), from the analytic elasticities. By the implicit function
+        theorem the equilibrium price moves with the tariff as
+        dp*/dt = -g_t / g_p'''
+        a, s = tar_wedge(t)
+        px = p*(1. - a) - s
+        d, sup, x = self.homedem(p), self.homesup(p), self.f(px, **self.forsup_pars)
+        dx = f_elas(self.f, px, **self.forsup_pars) * x / px      # f'(px)
+        g = d - sup - x
+        g_p = (self.homedem_elas(p)*d - self.homesup_elas(p)*sup) / p - dx*(1. - a)
+        g_t = dx*p if isinstance(t, tars.Ave) else dx
+        return g, g_p, g_t
+
+    @timed
+    @persist
+    def trademodel_path(self, tariffs, tartype=None, xtol=1e-12, maxiter=20):
+        ''' Solves the model along a path of tariff values by continuation:
+        each point starts from the previous solution, extrapolated with the
+        analytic dp*/dt, and is polished by Newton's method. Points where 
+        Newton fails are solved by solve_batch() instead.
+        Suited to long, finely spaced sequences of tariffs.
+
+        tariffs: array of tariff values, all of type tartype ('Ave' or 'Specific',
+                 defaults to TAR_type), best ordered
+        Returns the dict of trademodel_batch() plus
+            'nit': number of solver iterations per tariff (0 for 'lin', 
+                   which is solved in closed form)
+        '''
+        tartype = self.TAR_type if tartype is None else tartype
+        tariffs = np.atleast_1d(np.asarray(tariffs, dtype=float))
+        t = create_tar_instance(tartype, tariffs)
+        if not isinstance(t, tars.Tariff):
+            raise ValueError(f"Unknown tariff type: {tartype}")
+
+        P0, Q0 = self.home_notrade_equil()
+        nit = np.zeros(tariffs.shape, dtype=int)
+        if self.SYSTEM == 'lin':
+            pstar_t = self.lin_equil_price(t)
+        else:
+            PW, _ = self.free_trade_equil()
+            pstar_t = np.empty(tariffs.shape)
+            p, dpdt, t_prev = None, 0., 0.
+            for i, val in enumerate(tariffs):
+                ti = create_tar_instance(tartype, val)
+                converged = False
+                if p is not None:
+                    # predictor: first order step along the path
+                    guess = p + dpdt*(val - t_prev)
+                    if not guess > 0:
+                        guess = p
+                    x, n, converged = newton(lambda z: self.equil_derivs(z, ti)[:2],
+                                             guess, xtol, maxiter)
+                    nit[i] = n
+                    stats = instrument.current()
+                    if stats is not None:
+                        stats.solver('newton', converged, nit=n)
+                if converged:
+                    p = float(x)
+                else:
+                    # cold start, as in trademodel_batch
+                    equil = lambda z: self.impdem(z) - self.expsup(z, ti)
+                    x, n = solve_batch(equil, PW, P0, xtol=xtol)
+                    nit[i] += n
+                    p = float(x)
+                _, g_p, g_t = self.equil_derivs(p, ti)
+                dpdt, t_prev = -g_t/g_p, val
+                pstar_t[i] = p
+
+        endo = {}
+        endo['pstar_t'] = pstar_t
+        endo['xstar'] = self.expsup(pstar_t, t)
+        endo['pstar'] = self.expprice(endo['xstar'])     # as in trademodel
+        endo['mstar'] = self.impdem(pstar_t)
+        endo['dstar'] = self.homedem(pstar_t)
+        endo['sstar'] = self.homesup(pstar_t)
+        endo['P0'], endo['Q0'] = P0, Q0
+        endo['nit'] = nit
+
+        return endo
+
+    ################################################################
+    # elasticities
+    ################################################################
+
+    def homedem_elas(self, p):
+        ''' Returns the price elasticity of domestic demand at p'''
+        return f_elas(self.f, p, **self.homedem_pars)
+
+    def homesup_elas(self, p):
+        ''' Returns the price elasticity of domestic supply at p'''
+        return f_elas(self.f, p, **self.homesup_pars)
+
+    def impdem_elas(self, p):
+        ''' Returns the price elasticity of import demand at p: 
+        eM = (eD*D - eS*S) / (D - S)'''
+        d, s = self.homedem(p), self.homesup(p)
+        return (self.homedem_elas(p)*d - self.homesup_elas(p)*s) / (d - s)
+
+    def expsup_elas(self, p, t=0):
+        ''' Returns the elasticity of export supply with respect to the 
+        tariff-inclusive price p. With the exporter receiving 
+        px = p*(1-a) - s (see tar_wedge):
+        eX = eF(px) * (1-a) * p / px'''
+        a, s = tar_wedge(t)
+        px = p*(1. - a) - s
+        return f_elas(self.f, px, **self.forsup_pars) * (1. - a) * p / px
+
+    ################################################################
+    # welfare calculations
+    ################################################################
+
+    @timed
+    @persist
+    def home_welf(self, p0, p_t, pstar):
+        ''' Returns a dict with the components of changes in domestic welfare
+        relative to a an initial situation characterized by p0
+        (typically a free trade solution)
+         p0:   base price
+         P_t:  tariff-ridden domestic price
+         pstar: price received  by foreign exporter
+        p_t and pstar can be arrays, e.g. from trademodel_batch()
+        '''
+
+        # change consumer surplus: negative of area under demand cuve
+        d_cs = -f_int(self.f, p0, p_t, **self.homedem_pars)
+
+        # approx Hicksian EV and CV, see Deaton & Muellbauer
+        ev = -(p_t - p0) * self.homedem(p_t)
+        cv = -(p_t - p0) * self.homedem(p0)
+
+        # change producer surplus: area above inverse supply curve  = area below
+        # original curve
+        #
+        d_ps = f_int(self.f, p0, p_t, **self.homesup_pars)
+
+        # terms of trade effect
+        tot = (p0 - pstar) * self.impdem(p_t)
+        # tariff revenues
+        rev = (p_t - pstar) * self.impdem(p_t)
+
+        # collect results
+        welf = {}
+        welf["dCS"] = d_cs
+        welf["dPS"] = d_ps
+        welf["dRev"] = rev
+        # deadweight loss: net of consumer loss and producer gains and gov revenue
+        welf["DW"] = welf["dCS"] +  welf["dPS"] + welf["dRev"]
+        welf["ToT"] = tot
+        welf["total"] = welf["dCS"] + welf["dPS"] + welf["dRev"]
+        welf["EV"] = ev
+        welf["CV"] = cv
+        return welf
+
+    @timed
+    @persist
+    def foreign_welf(self, p0, pstar):
+        # ToT loss
+        # producer surplus loss: area under the export supply curve
+        d_ps = f_int(self.f, p0, pstar, **self.forsup_pars)
+        welf = {}
+        welf['ToT'] = -(p0 - pstar) * self.expsup(pstar, 0)
+        welf['dPS'] = d_ps
+
+        return welf
+
+    ################################################################
+    # optimal tariff
+    ################################################################
+
+    @timed
+    def prohibitive_tariff(self, tariff_type=None, eps=0.0):
+        ''' Returns the tariff of tariff_type (defaults to TAR_type) at which
+        imports fall to eps.
+
+        Imports equal eps at the home price p where impdem(p) = eps, i.e. the
+        autarky price for eps = 0. The exporter then supplies eps, so it must
+        receive px = expprice(eps), and the tariff bridges the gap:
+        Ave:      p*(1-t) = px  =>  t = 1 - px/p
+        Specific: p - t = px    =>  t = p - px
+        In linlog and tab export supply only vanishes at px = 0, i.e. t = 1 (Ave) or t = P0
+        (Specific).
+        '''
+        tariff_type = self.TAR_type if tariff_type is None else tariff_type
+        if eps == 0:
+            p, _ = self.home_notrade_equil()
+        elif self.SYSTEM == 'lin':
+            hd, hs = self.homedem_pars, self.homesup_pars
+            p = (hd["const"] - hs["const"] - eps) / (hs["slope"] - hd["slope"])
+        else:
+            # imports fall from their free trade level to eps at the autarky price
+            P0, _ = self.home_notrade_equil()
+            PW, _ = self.free_trade_equil()
+            p = solve(lambda p: self.impdem(p) - eps, PW, P0)
+
+        px = self.expprice(eps)
+        if tariff_type == 'Ave':
+            return 1. - px/p
+        elif tariff_type == 'Specific':
+            return p - px
+        else:
+            raise ValueError(f"Unknown tariff type: {tariff_type}")
+
+    @timed
+    def find_optimal_tariff(self, tariff_type=None, objective='total', xtol=1e-8):
+        ''' Finds the tariff that maximizes home welfare by bounded scalar
+        optimization (Brent) between free trade and the prohibitive tariff.
+
+        tariff_type: 'Ave' or 'Specific', defaults to TAR_type
+        objective: what to maximize, see welfare_objective(). Default 'total'
+        xtol: absolute precision of the optimal tariff
+
+        Returns a dict with
+            'tariff': the optimal tariff value
+            'ave': its ad-valorem equivalent (Tariff.ave at the equilibrium price)
+            'welf': the value of the objective at the optimum
+            'nfev': number of equilibrium and welfare evaluations
+            'success': convergence flag of the optimizer
+        '''
+        tariff_type = self.TAR_type if tariff_type is None else tariff_type
+        score = welfare_objective(objective)
+        pw, _ = self.free_trade_equil()
+
+        def neg_welf(v):
+            eq, _ = self.trademodel(create_tar_instance(tariff_type, v))
+            return -score(self.home_welf(pw, eq['pstar_t'], eq['pstar']))
+
+        from scipy import optimize
+        upper = self.prohibitive_tariff(tariff_type)
+        sol = optimize.minimize_scalar(neg_welf, bounds=(0., upper), method='bounded',
+                                       options={'xatol': xtol})
+        stats = instrument.current()
+        if stats is not None:
+            stats.solver('minimize_scalar', sol.success, nit=sol.nit, nfev=sol.nfev,
+                         message=sol.message)
+
+        tar = create_tar_instance(tariff_type, sol.x)
+        eq, _ = self.trademodel(tar)
+        return {'tariff': sol.x,
+                'ave': tar.ave(eq['pstar_t']),
+                'welf': -sol.fun,
+                'nfev': sol.nfev,
+                'success': sol.success}
+
+
+def welfare_objective(objective):
+    ''' Returns a function scoring a home_welf() dict.
+    objective: a key of home_welf(), e.g. 'total'
+               or a dict of weights, e.g. {'dCS': 0.4, 'dPS': 0.3, 'dRev': 0.3}
+               or a function taking the home_welf() dict'''
+    if callable(objective):
+        return objective
+    elif isinstance(objective, dict):
+        return lambda w: sum(wt * w[k] for k, wt in objective.items())
     else:
-        p_tar  = p
+        return lambda w: w[objective]
 
-    return f(p_tar , **pars)
 
-def expprice(x):
-    '''Inverse of expsup(p) returns foreign export price as function of 
-    export volume x'''
-    
-    # Below lambda function is required to fix parameter t 
-    # for the root finder in f_inv()
+def world_welf(w_home, w_foreign):
+    welf = {}
+    welf['dCS_h'] = w_home['dCS']
+    welf['dPS_h'] = w_home['dPS']
+    welf['dRev_h'] = w_home['dRev']
+    welf['ToT_h'] = w_home['ToT']
+    welf['Net Home'] = welf['dCS_h'] + welf['dPS_h'] + welf['dRev_h']
 
-    # Alternatively use functools.partial() to hold constant the parameter t like so:
-    # f_inv(partial(expsup, t=0), exo=x)
-    
-    f1 = lambda x: expsup(x, t = 0)
-    return f_inv(f1, exo=x)
+    welf['dPS_f'] = w_foreign['dPS']
+    welf['ToT_f'] = w_foreign['ToT']
+    welf['Net Foreign'] = welf['dPS_f']
 
+    welf['Net WORLD'] = welf['Net Home'] + welf['Net Foreign']
 
+    return welf
 
-def home_notrade_equil():
-    '''Returns no trade equilibrium in home market, i.e when 
-        domestic demand equals domestic supply and hence impdem(p) = 0.
-         Solves the intersection of D-S numerically'''
-    
-    equil = solve(impdem, init = homedem_pars["const"])
-    p = equil.x
-    q = homedem(p)
-    return (p[0],q[0]) 
-
-
-#%% generate results 
-
-def generate_markets():
-    '''generate some data to plot the demand and supply functions'''
-
-    res = {'p':[], 'd':[], 's':[],'x':[], 'm':[], 'pw':0.0, 'm1':0.0}
-           
-    # find suitable range of prices to plot
-    P0, Q0 = home_notrade_equil()
-    
-    # free trade equilibrium 
-    def equil(p):                    
-        return impdem(p) - expsup(p, t=0)
-    eq = solve(equil, init=0.01)
-    PW, m1 = eq.x[0], expsup(eq.x[0], t=0)
-    
-    alfa = 4 # ratio of largest and midpoint on home quantity axis
-    beta = 3 # ratio of largest and midpoint on world quantity axis
-
-    P1, P2 = f_inv(homedem, Q0*alfa), f_inv(homedem, Q0/alfa)
-    P3, P4 = expprice(m1/beta), expprice(m1*beta)
-
-    # finally, this is the price range that should work (mostly) 
-    start, stop = max(min(P1,P3),1e-3), max(min(P2, P4),1e-3)
-    
-    numdat = 20    
-    res['p'] = [p for p in np.linspace(start,stop, numdat)]
-    res['d'] = [homedem(p) for p in res['p']]
-    res['s'] = [homesup(p) for p in res['p']]
-    res['m'] = [impdem(p) for p in res['p']]
-    res['x'] = [expsup(p, t=0) for p in res['p']]
-    
-     
-    res['pw'] = PW
-    res['m1'] = expsup(res['pw'], t=0)
-    res['s1'] = homesup(res['pw'])
-    res['d1'] = homedem(res['pw'])
- 
-    return res
 
 ###########################################################################
-# The PE model
+# module level interface: the model of the parameters read from PARFILE
 ###########################################################################
 
+_default = None
+
+def default_model():
+    ''' Returns the TradeModel of the module level parameters,
+    rebuilt only when these change'''
+    global _default
+    if not _loaded:
+        load_params()
+    if _default is None or _default.key != parkey() \
+            or (_default.MONEY, _default.VOLUME) != (MONEY, VOLUME):
+        _default = TradeModel({"SYSTEM": SYSTEM, "MONEY": MONEY, "VOLUME": VOLUME,
+                               "TAR_type": TAR_type, "TAR_val": TAR_val,
+                               "homedem_pars": homedem_pars,
+                               "homesup_pars": homesup_pars,
+                               "forsup_pars": forsup_pars})
+    return _default
+
+# units are set from the parameter file by load_params()
+@set_unit(DEFAULTS["VOLUME"])
+def homedem(p, pars=None):
+    ''' Returns domestic demand quantity as function of price p'''
+    model = default_model()
+    return model.homedem(p) if pars is None else model.f(p, **pars)
+
+def homesup(p, pars=None):
+    ''' Returns domestic supply quantity as function of price p'''
+    model = default_model()
+    return model.homesup(p) if pars is None else model.f(p, **pars)
+
+def impdem(p):
+    '''returns demand for imports as function of price'''
+    return default_model().impdem(p)
+
+def expsup(p, t:tars.Tariff, pars=None):
+    ''' Returns foreign supply quantity as function of
+    price p and tariff t'''
+    model = default_model()
+    if pars is not None:
+        return TradeModel({"SYSTEM": model.SYSTEM, "forsup_pars": pars}).expsup(p, t)
+    return model.expsup(p, t)
+
+def expprice(x):
+    '''Inverse of expsup(p) returns foreign export price as function of
+    export volume x'''
+    return default_model().expprice(x)
+
+def home_notrade_equil():
+    return default_model().home_notrade_equil()
+
+def lin_equil_price(t):
+    return default_model().lin_equil_price(t)
+
+def free_trade_equil():
+    return default_model().free_trade_equil()
+
+def generate_markets(numdat=20, adaptive=False):
+    return default_model().generate_markets(numdat, adaptive)
+
 def trademodel(tariff:tars.Tariff, **kwargs):
-    ''' The equations and solution of the model '''
-
-    exog = {'tariff': tariff.value}
-
-    endo = {'pstar_t': 0.0,
-            'pstar': 0.0,
-            'mstar': 0.0,
-            'xstar': 0.0,
-            'dstar': 0.0,
-            'sstar': 0.0,
-            'P0':0,
-            'Q0':0}
-    
-    desc = {'pstar_t': 'tariff-inclusive price on home market',
-            'pstar': 'price received by exporter',
-            'mstar': 'import quantity',
-            'xstar': 'export quantity',
-            'dstar': 'domestic demand quantity',
-            'sstar': 'domestic supply quantity',
-            'tariff': str(tariff),
-            'P0': f'Price at home no-trade equilibrium ({MONEY})',
-            'Q0': f'Quantity at home no-trade equilibrium ({VOLUME})',
-            }
-    if kwargs: 
-        for k, v in kwargs.items():
-            desc[k] = v
-    
-    t = tariff
-    
-    '''Equilibrium condition 
-    It clears domestic and foreign markets:
-    M(p) = D(p) - S(p)  
-    M(p) = X(p,t)
-    so that (D - S - X) = 0 yields the tariff-ridden price. 
-      Solves numerically'
-    '''
-    def equil(p):                           # eqilibrium condition
-        return impdem(p) - expsup(p, t)
-    
-    eq = solve(equil, init=0.01)
-    pstar_t = eq.x[0]                      # equilibrium tariff-inclusive price
-    xstar = expsup(pstar_t, t=t)           # export quantity 
+    return default_model().trademodel(tariff, **kwargs)
 
-    endo['pstar_t'] = pstar_t              
-    endo['xstar'] = xstar
-    endo['pstar'] = expprice(xstar)        # price received by exporter
-    endo['mstar'] = impdem(pstar_t)        # imports
-    endo['dstar'] = homedem(pstar_t)       # doemstic demand
-    endo['sstar'] = homesup(pstar_t)       # domestic supply
+def trademodel_batch(tariffs, tartype=None):
+    return default_model().trademodel_batch(tariffs, tartype)
 
-    endo['P0'], endo['Q0'] = home_notrade_equil() # autarky solution
+def trademodel_path(tariffs, tartype=None):
+    return default_model().trademodel_path(tariffs, tartype)
 
-    return endo, desc
+def homedem_elas(p):
+    return default_model().homedem_elas(p)
 
+def homesup_elas(p):
+    return default_model().homesup_elas(p)
 
-################################################################
-# welfare calculations
-################################################################
-   
-@set_unit(MONEY)
-def home_welf(p0, p_t, pstar):
-    ''' Returns a dict with the components of changes in domestic welfare
-    relative to a an initial situation characterized by p0 
-    (typically a free trade solution)
-     p0:   base price
-     P_t:  tariff-ridden domestic price
-     pstar: price received  by foreign exporter
-    '''
+def impdem_elas(p):
+    return default_model().impdem_elas(p)
 
-    # change consumer surplus: negative of area under demand cuve
-    d_cs = -quad(homedem, p0, p_t)[0] 
-
-    # approx Hicksian EV and CV, see Deaton & Muellbauer
-    ev = -(p_t - p0) * homedem(p_t)  
-    cv = -(p_t - p0) * homedem(p0)
-
-    # change producer surplus: area above inverse supply curve  = area below 
-    # original curve
-    #
-    d_ps = (quad(homesup, p0, p_t)[0])
-    
-    # terms of trade effect
-    tot = (p0 - pstar) * impdem(p_t)  
-    # tariff revenues
-    rev = (p_t - pstar) * impdem(p_t)
-    
-    # collect results 
-    welf = {}
-    welf["dCS"] = d_cs
-    welf["dPS"] = d_ps
-    welf["dRev"] = rev
-    # deadweight loss: net of consumer loss and producer gains and gov revenue
-    welf["DW"] = welf["dCS"] +  welf["dPS"] + welf["dRev"]
-    welf["ToT"] = tot
-    welf["total"] = welf["dCS"] + welf["dPS"] + welf["dRev"] 
-    welf["EV"] = ev
-    welf["CV"] = cv
-    return welf
+def expsup_elas(p, t=0):
+    return default_model().expsup_elas(p, t)
+
+@set_unit(DEFAULTS["MONEY"])
+def home_welf(p0, p_t, pstar):
+    return default_model().home_welf(p0, p_t, pstar)
 
 def foreign_welf(p0, pstar):
-    # ToT loss
-    # producer surplus loss
-    f1 = lambda x: expsup(x, t = 0)
-    d_ps = (quad(f1, p0, pstar)[0])
-    welf = {}
-    welf['ToT'] = -(p0 - pstar) * expsup(pstar, 0) 
-    welf['dPS'] = d_ps
+    return default_model().foreign_welf(p0, pstar)
 
-    return welf
+def prohibitive_tariff(tariff_type=None, eps=0.0):
+    return default_model().prohibitive_tariff(tariff_type, eps)
 
-def world_welf(w_home, w_foreign):
-    welf = {}
-    welf['dCS_h'] = w_home['dCS']
-    welf['dPS_h'] = w_home['dPS']
-    welf['dRev_h'] = w_home['dRev']
-    welf['ToT_h'] = w_home['ToT']
-    welf['Net Home'] = welf['dCS_h'] + welf['dPS_h'] + welf['dRev_h']
-    
-    welf['dPS_f'] = w_foreign['dPS']
-    welf['ToT_f'] = w_foreign['ToT']
-    welf['Net Foreign'] = welf['dPS_f']
-
-    welf['Net WORLD'] = welf['Net Home'] + welf['Net Foreign']
- 
-    return welf
+def find_optimal_tariff(params=None, tariff_type=None, objective='total',
+                        xtol=1e-8):
+    ''' Finds the tariff that maximizes home welfare, see
+    TradeModel.find_optimal_tariff.
+    params: parameter dict as in the parameter files, defaults to the
+            parameters read from PARFILE'''
+    model = default_model() if params is None else TradeModel(params)
+    return model.find_optimal_tariff(tariff_type, objective, xtol)
 
 
 #%% Trial run the model 
 
-t = create_tar_instance(TAR_type, TAR_val)
-res = generate_markets()
-eq, labels = trademodel(t, Description='Large country model trial run')
+def trial_run():
+    if not _loaded:
+        load_params()
+    t = create_tar_instance(TAR_type, TAR_val)
+    res = generate_markets()
+    eq, labels = trademodel(t, Description='Large country model trial run')
+
+    results_with_labels_dict = {k:(round(eq[k],3),labels[k]) for k in eq}
 
-results_with_labels_dict = {k:(round(eq[k],3),labels[k]) for k in eq}
+    print('*'*20)
+    print(f"Trial run\n{labels['Description']} with tariff {t.value} {t.get_tartype()}\n"
+          f"{pretty_print(results_with_labels_dict, fw=8, indent = 1)}")
+    print('*'*20)
 
-print('*'*20)
-print(f"Trial run\n{labels['Description']} with tariff {t.value} {t.get_tartype()}\n"
-      f"{pretty_print(results_with_labels_dict, fw=8, indent = 1)}")
-print('*'*20)
 
+if __name__ == '__main__':
+    trial_run()
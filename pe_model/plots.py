@@ -1,27 +1,49 @@
 #plots.py
+''' Plots of the markets, the equilibrium and the welfare effects of tariffs.
+
+Every plot function saves its figure as FIGPATH/<stem>_<name>.<fmt>, 
+stem defaulting to the stem of PARFILE and fmt to 'svg' (use 'png' for large
+batches). Figures are closed once saved, except the one returned by 
+plot_markets(), which plot_equil() draws on.
+render() runs a list of plot jobs headless (Agg) in a process pool.
+TariffExplorer shows plot_equil() interactively, with a tariff slider.
+'''
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import os
 import numpy as np
 
 import init
-FIGPATH = init.FIGPATH
 
 font = {'size': 12, 'family' : 'sans-serif'}
 plt.rc('font', **font)
 
 
+def save_fig(fig, name, stem=None, fmt='svg', dpi=100, figdir=None):
+    ''' Saves fig as figdir/<stem>_<name>.<fmt> and returns the path. 
+    figdir defaults to FIGPATH, stem to the stem of PARFILE'''
+    if figdir is None:
+        init.make_dirs()
+        figdir = init.FIGPATH
+    stem = init.PARFILE.stem if stem is None else stem
+    figpath = Path(figdir) / f"{stem}_{name}.{fmt}"
+    fig.savefig(figpath, dpi=dpi)
+    return figpath
+
+
 
 def get_offset(ax, dx, dy):
         dp_to_dd = ax.transData.inverted().transform([dx,dy]) \
                    - ax.transData.inverted().transform([0,0])  
         return dp_to_dd
 
-def plot_markets(res):
-    fig, (homeax, worldax) = plt.subplots(1,2,layout='tight', sharey= True, sharex=False,
-                                          num=1)
-    plt.subplots_adjust(left = 0.15, right=0.99, bottom=0.2, wspace=0.)
+def plot_markets(res, save=True, stem=None, fmt='svg', dpi=100, figdir=None):
+    ''' Plots home and world markets, returns the figure'''
+    fig, (homeax, worldax) = plt.subplots(1,2,layout='tight', sharey= True, sharex=False)
+    fig.subplots_adjust(left = 0.15, right=0.99, bottom=0.2, wspace=0.)
 
     homeax.set_ylabel("Price", rotation = 0, 
                   loc = 'top')
@@ -89,57 +111,173 @@ def plot_markets(res):
     worldax.text(res['m1'],-yoff, r'$M_1 = D_1 - S_1$', va='top')
     
     
-    figpath = FIGPATH / str(init.PARFILE.stem +'_fig1a.svg')
-    plt.savefig(figpath, dpi=100)
-    print(f"Figure 'markets' saved as: {figpath} ")
+    if save:
+        figpath = save_fig(fig, 'fig1a', stem, fmt, dpi, figdir)
+        print(f"Figure 'markets' saved as: {figpath} ")
     
     return fig
 
 
-def plot_equil(figure, res, eq, x_t=[], show=False):
-    x_t_toplot = x_t
+def equil_geometry(homeax, worldax, res, eq, x_t, xoff, yoff):
+    ''' Returns the positions of the tariff-dependent artists of plot_equil():
+    (xdata, ydata) for the lines, (x, y) for the labels'''
+    xmax = homeax.get_xlim()[1]
+    return {'x_t': (x_t, res['p']),
+            'world_pstar': ([0, eq['xstar']], [eq['pstar']]*2),
+            'world_pstar_t': ([0, eq['xstar']], [eq['pstar_t']]*2),
+            'world_xstar': ([eq['xstar']]*2, [0, eq['pstar_t']]),
+            'home_pstar': ([0, xmax], [eq['pstar']]*2),
+            'home_pstar_t': ([0, xmax], [eq['pstar_t']]*2),
+            'home_sstar': ([eq['sstar']]*2, [0, eq['pstar_t']]),
+            'home_dstar': ([eq['dstar']]*2, [0, eq['pstar_t']]),
+            'label_X*': (np.max(x_t), np.max(res['p'])),
+            'label_P*': (-xoff*3, eq['pstar']),
+            'label_P*+t': (-xoff*3.5, eq['pstar_t']),
+            'label_S2': (eq['sstar'], -yoff),
+            'label_D2': (eq['dstar'], -yoff),
+            'label_X2': (eq['xstar'], -yoff)}
+
+
+def draw_equil(figure, res, eq, x_t, animated=False):
+    ''' Draws the tariff equilibrium on the figure of plot_markets().
+    Returns the dict of its artists (lines and labels), whose data 
+    update_equil() changes for another tariff'''
+    homeax, worldax = figure.get_axes()[:2]
     fs = plt.rcParams['font.size']
-    
-    axes = figure.get_axes()
-    homeax, worldax = axes[0], axes[1]
-  
-    xoff, yoff = get_offset(homeax, dx=fs, dy=fs) 
-
-    # tariff-ridden export supply
-    worldax.plot(x_t_toplot, res['p'], color = 'red')
-
-    worldax.hlines(eq['pstar'], 0, eq['xstar'], ls='--', color='red')
-    worldax.hlines(eq['pstar_t'], 0, eq['xstar'], ls='--', color='red')
-    worldax.vlines(eq['xstar'],0, eq['pstar_t'], ls ='--', color = 'red')
-    worldax.text(max(x_t_toplot), max(res['p']), r'$X^*$', ha='left', va='bottom')
-
-    homeax.hlines(eq['pstar'], 0, homeax.get_xlim()[1], ls='--', color='red')
-    homeax.hlines(eq['pstar_t'], 0, homeax.get_xlim()[1], ls='--', color='red')
+    xoff, yoff = get_offset(homeax, dx=fs, dy=fs)
+    geom = equil_geometry(homeax, worldax, res, eq, x_t, xoff, yoff)
+
+    artists = {}
+    # tariff-ridden export supply, and dashed lines at the equilibrium
+    artists['x_t'], = worldax.plot(*geom['x_t'], color='red', animated=animated)
+    for key in ['world_pstar', 'world_pstar_t', 'world_xstar']:
+        artists[key], = worldax.plot(*geom[key], ls='--', color='red', animated=animated)
+    for key in ['home_pstar', 'home_pstar_t', 'home_sstar', 'home_dstar']:
+        artists[key], = homeax.plot(*geom[key], ls='--', color='red', animated=animated)
+
+    labels = {'label_X*': (worldax, r'$X^*$', dict(ha='left', va='bottom')),
+              'label_P*': (homeax, r'$P^*$', {}),
+              'label_P*+t': (homeax, r'$P^{*+t}$', dict(va='bottom')),
+              'label_S2': (homeax, r"$S_2$", dict(ha='center', va='center', color='red')),
+              'label_D2': (homeax, r"$D_2$", dict(ha='center', va='center', color='red')),
+              'label_X2': (worldax, r"$X_2$", dict(ha='center', va='center', color='red'))}
+    for key, (ax, text, kw) in labels.items():
+        artists[key] = ax.text(*geom[key], text, animated=animated, **kw)
+
+    # kept for update_equil()
+    artists['_offset'] = (xoff, yoff)
+    return artists
+
+
+def update_equil(artists, figure, res, eq, x_t):
+    ''' Moves the artists of draw_equil() to the equilibrium eq with 
+    tariff-ridden export supply x_t, without drawing'''
+    homeax, worldax = figure.get_axes()[:2]
+    geom = equil_geometry(homeax, worldax, res, eq, x_t, *artists['_offset'])
+    for key, pos in geom.items():
+        if key.startswith('label_'):
+            artists[key].set_position(pos)
+        else:
+            artists[key].set_data(*pos)
+
+
+def plot_equil(figure, res, eq, x_t=[], show=False, close=True,
+               stem=None, fmt='svg', dpi=100, figdir=None):
+    ''' Adds the tariff equilibrium to the figure of plot_markets(), 
+    saves it and returns the path'''
+    draw_equil(figure, res, eq, x_t)
+
+    figpath = save_fig(figure, 'fig1b', stem, fmt, dpi, figdir)
+    print(f"Figure 'markets equilibrium'saved as: {figpath} ")
 
+    if show == True:
+        plt.show()
+    if close:
+        plt.close(figure)
+    return figpath
 
-    homeax.text(-xoff*3,eq['pstar'],r'$P^*$')
-    homeax.text(-xoff*3.5,eq['pstar_t'],r'$P^{*+t}$', va='bottom')
 
-    homeax.vlines(eq['sstar'], 0, eq['pstar_t'], ls ='--', color = 'red')
-    homeax.vlines(eq['dstar'], 0, eq['pstar_t'], ls ='--', color = 'red')
-    homeax.text(eq['sstar'], -yoff, r"$S_2$", ha='center', va='center', color = 'red')
+class TariffExplorer():
+    ''' Interactive plot_equil() with a tariff slider.
 
-    homeax.text(eq['dstar'], -yoff, r"$D_2$", ha='center', va='center', color = 'red')
+    The markets of plot_markets() are drawn once and kept as a bitmap. 
+    Moving the slider only solves the new equilibrium, moves the 
+    tariff-dependent artists (see draw_equil) and blits them, with the 
+    slider, onto the kept bitmap. A full redraw, e.g. on resizing,
+    renews the bitmap.
 
-    worldax.text(eq['xstar'], -yoff, r"$X_2$", ha = 'center', va='center', color = 'red')
-    
-    
-    figpath = FIGPATH / str(init.PARFILE.stem +'_fig1b.svg')
-    plt.savefig(figpath, dpi=100)
-    print(f"Figure 'markets equilibrium'saved as: {figpath} ")
+    res: markets of generate_markets()
+    solve: function of the tariff value returning (eq, x_t), the
+           equilibrium (as trademodel) and tariff-ridden export supply at res['p']
+    valmax: largest tariff on the slider
+    Needs an interactive matplotlib backend, e.g. %matplotlib widget in a notebook.
+    '''
 
-    if show == True:
-        plt.show()
+    def __init__(self, res, solve, valmax, valinit=0., valmin=0., label='Tariff'):
+        from matplotlib.widgets import Slider
+
+        self.res, self.solve = res, solve
+        self.fig = plot_markets(res, save=False)
+        self.fig.set_layout_engine('none')
+        self.fig.subplots_adjust(left=0.15, right=0.95, bottom=0.3, wspace=0.25)
+        self.canvas = self.fig.canvas
+
+        eq, x_t = solve(valinit)
+        self.artists = draw_equil(self.fig, res, eq, x_t, animated=True)
+        sax = self.fig.add_axes([0.25, 0.04, 0.5, 0.04])
+        # a plain format, the default one is mathtext, parsed anew for every value
+        self.slider = Slider(sax, label, valmin, valmax, valinit=valinit, valfmt='%.3f')
+        self.slider.drawon = False              # drawn with the artists
+        self.slider.on_changed(self.update)
+
+        self._background = None
+        self._cid = self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    @classmethod
+    def from_model(cls, model, tariff_type=None, valmax=None, valinit=0.):
+        ''' Returns the explorer of a pe_model.TradeModel, with the slider 
+        from free trade to (nearly) the prohibitive tariff of tariff_type'''
+        import tariffs as tars
+        tariff_type = model.TAR_type if tariff_type is None else tariff_type
+        tarclass = {'Ave': tars.Ave, 'Specific': tars.Specific}[tariff_type]
+        res = model.generate_markets()
+        if valmax is None:
+            valmax = model.prohibitive_tariff(tariff_type, eps=1e-5)
+
+        def solve(value):
+            t = tarclass(value)
+            eq = model.trademodel_batch(np.array([value]), tariff_type)
+            eq = {k: np.ravel(v)[0] for k, v in eq.items()}
+            return eq, model.expsup(res['p'], t)
+
+        return cls(res, solve, valmax, valinit=valinit, label=f"Tariff\n({tariff_type})")
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for key, artist in self.artists.items():
+            if not key.startswith('_'):
+                self.fig.draw_artist(artist)
+
+    def update(self, value):
+        ''' Moves the equilibrium to tariff value and blits it'''
+        eq, x_t = self.solve(value)
+        update_equil(self.artists, self.fig, self.res, eq, x_t)
+        if self._background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self._background)
+        self._draw_artists()
+        self.fig.draw_artist(self.slider.ax)
+        self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
 
 
 # optimal tariff plot
 def opt_tar_plot(opt_tar_toplot, key = 'welf', ylabel='Importer welfare',
-                 show = False):
+                 show = False, close=True, stem=None, fmt='svg', dpi=100, figdir=None):
     '''Plots change in one welfare component against tariffs.
     E.g. total domestic welfareor traiff revenues
     
@@ -152,12 +290,12 @@ def opt_tar_plot(opt_tar_toplot, key = 'welf', ylabel='Importer welfare',
                   'unit':''}
     REQUIRED keys: tar, tartype, AVE, unit.
     At least one plotable series in the keys, e.g. 'welf'   
-
+    Returns the path of the saved figure
     '''
 
     # set up the figure 
     fig, ax = plt.subplots(layout='tight')
-    plt.subplots_adjust(left=0.1, right=0.9)
+    fig.subplots_adjust(left=0.1, right=0.9)
 
     ax.spines[['right', 'top']].set_visible(False)
     ax.spines['bottom'].set_position(('data',0))
@@ -217,11 +355,71 @@ def opt_tar_plot(opt_tar_toplot, key = 'welf', ylabel='Importer welfare',
                                 bbox=bbox, arrowprops={"arrowstyle":"->"} 
                 )
     
-    figpath = FIGPATH / str(init.PARFILE.stem +f'_{ylabel}.svg')
-    plt.savefig(figpath, dpi=100)
+    figpath = save_fig(fig, ylabel, stem, fmt, dpi, figdir)
     print(f"Figure optimal tariff {ylabel} saved as: {figpath} ")
 
     if show == True:
         plt.show()
+    if close:
+        plt.close(fig)
+    return figpath
+
+
+#############################################################
+# rendering pipeline
+#############################################################
+
+def _init_agg():
+    plt.switch_backend('agg')
+
+
+def render_job(job):
+    ''' Renders one plot job, returns the path of the saved figure.
+    job is a dict with 'plot' and the arguments of that plot:
+        {'plot': 'markets', 'res': res}
+        {'plot': 'equil', 'res': res, 'eq': eq, 'x_t': x_t}
+        {'plot': 'opt_tar', 'data': opt_tar_toplot, 'key': 'welf', 'ylabel': 'Importer welfare'}
+    and optionally 'stem', 'fmt', 'dpi' and 'figdir' (see save_fig)'''
+    out = {k: job[k] for k in ['stem', 'fmt', 'dpi', 'figdir'] if k in job}
+    if job['plot'] == 'markets':
+        fig = plot_markets(job['res'], save=False)
+        figpath = save_fig(fig, 'fig1a', **out)
+        print(f"Figure 'markets' saved as: {figpath} ")
+        plt.close(fig)
+    elif job['plot'] == 'equil':
+        fig = plot_markets(job['res'], save=False)
+        figpath = plot_equil(fig, job['res'], job['eq'], x_t=job['x_t'], **out)
+    elif job['plot'] == 'opt_tar':
+        figpath = opt_tar_plot(job['data'], key=job['key'], ylabel=job['ylabel'], **out)
+    else:
+        raise ValueError(f"Unknown plot: {job['plot']}")
+    return figpath
+
+
+def render(jobs, workers=None, fmt='svg', dpi=100, stem=None, figdir=None):
+    ''' Renders a list of plot jobs (see render_job) headless with the Agg
+    backend in a pool of workers processes (default os.cpu_count(),
+    1 renders in this process and restores its backend after, which closes
+    any open figures). fmt, dpi, stem and figdir apply to all jobs 
+    that do not set their own. Every figure is closed after saving.
+    Returns the paths of the saved figures'''
+    if figdir is None:
+        init.make_dirs()
+        figdir = init.FIGPATH
+    stem = init.PARFILE.stem if stem is None else stem
+    common = {'fmt': fmt, 'dpi': dpi, 'stem': stem, 'figdir': figdir}
+    jobs = [{**common, **job} for job in jobs]
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers == 1 or len(jobs) == 1:
+        backend = plt.get_backend()
+        _init_agg()
+        try:
+            return [render_job(job) for job in jobs]
+        finally:
+            plt.switch_backend(backend)
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                             initializer=_init_agg) as pool:
+        return list(pool.map(render_job, jobs))
    
     
\ No newline at end of file
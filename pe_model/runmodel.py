@@ -2,12 +2,22 @@
 #%% imports
 import pe_model as mod
 from kitchen import pretty_print
-from plots import *       #plot_equil, plot_markets, opt_tar_plot
-from basefuncs import elas
+from store import ResultWriter
+import init
 
+import numpy as np
 import sys
 from pathlib import Path
 
+# figures need matplotlib, which is only imported when they are wanted
+# run as: python runmodel.py --no-figures to skip them
+FIGURES = '--no-figures' not in sys.argv
+
+# python runmodel.py --cache keeps the results in a persistent cache, so that 
+# runs of scenarios computed before become lookups (see pe_model.use_disk_cache)
+if '--cache' in sys.argv:
+    mod.use_disk_cache(Path(__file__).parent / "cache.sqlite")
+
 
 
 #%% run model 
@@ -29,19 +39,21 @@ w_world = mod.world_welf(w_home, w_fore)
 
 
 # elasticities
-f1 =  lambda x: mod.expsup(x, t = 0)
 elas_dict = {
-            "Home demand" : elas(mod.homedem, pstar_t),
-            "Home supply" : elas(mod.homesup, pstar_t),
-            "Import demand" : elas(mod.impdem, pstar),
-            "Export supply": elas(f1, pstar),
+            "Home demand" : mod.homedem_elas(pstar_t),
+            "Home supply" : mod.homesup_elas(pstar_t),
+            "Import demand" : mod.impdem_elas(pstar),
+            "Export supply": mod.expsup_elas(pstar, t = 0),
             }           
 
 
-fig1 = plot_markets(res)
-plot_equil(fig1, res, eq, 
-           x_t = [mod.expsup(p, t=t) for p in res['p']],  # tariff-ridden export supply
-           show= False)
+if FIGURES:
+    from plots import render
+
+    # figures are rendered together at the end
+    plot_jobs = [{'plot': 'markets', 'res': res},
+                 {'plot': 'equil', 'res': res, 'eq': eq, 
+                  'x_t': mod.expsup(res['p'], t=t)}]  # tariff-ridden export supply
 
 
 #%% optimal tariff calculatiions and plots
@@ -64,61 +76,62 @@ opt_tar_toplot["tartype"] = tar.get_tartype()
 opt_tar_toplot['unit'] = mod.home_welf.unit
 
 base = mod.generate_markets()
-m = base['m1'] # free trade imports
 pw = base['pw'] # free trade price on home and world markets
 
+# grid of tariffs from free trade up to the prohibitive tariff, i.e. where 
+# imports become too small. In linlog model 0 is a problem
 eps = 1e-5
-while m >= eps: # stop when imports become too small. In linlog model 0 is a problem
-    eq, _ = mod.trademodel(tar, Description='Large country model 1')
-    pstar_t = eq['pstar_t']
-    m = eq['mstar']
-    pstar = eq['pstar'] 
-
-    if m < eps: break # to avoid furher calculations when imports are negative
-       
-    welf_res = mod.home_welf(pw, pstar_t, pstar)
-    opt_tar_toplot['welf'].append(welf_res["total"])
-    opt_tar_toplot['dCS'].append(welf_res["dCS"])
-    opt_tar_toplot['dPS'].append(welf_res["dPS"])
-    opt_tar_toplot['rev'].append(welf_res["dRev"])
-    opt_tar_toplot['ToT'].append(welf_res["ToT"])
-    opt_tar_toplot['tar'].append(tar.value)
-    opt_tar_toplot["AVE"].append(tar.ave(pstar_t))
-           
-    tar.value +=0.01    
+prohib = mod.prohibitive_tariff(mod.TAR_type, eps=eps)
+tar_grid = np.append(np.arange(valbase, prohib, 0.01), prohib)
+
+eq_grid = mod.trademodel_batch(tar_grid, mod.TAR_type)
+welf_res = mod.home_welf(pw, eq_grid['pstar_t'], eq_grid['pstar'])
+opt_tar_toplot['welf'] = welf_res["total"].tolist()
+opt_tar_toplot['dCS'] = welf_res["dCS"].tolist()
+opt_tar_toplot['dPS'] = welf_res["dPS"].tolist()
+opt_tar_toplot['rev'] = welf_res["dRev"].tolist()
+opt_tar_toplot['ToT'] = welf_res["ToT"].tolist()
+opt_tar_toplot['tar'] = tar_grid.tolist()
+opt_tar_toplot["AVE"] = mod.create_tar_instance(mod.TAR_type, tar_grid).ave(eq_grid['pstar_t']).tolist()
+
+# store the grid results for later analysis, read back with store.read_results()
+init.make_dirs()
+gridstore = mod.TEXTPATH / f"{mod.PARFILE.stem}_tariffs"
+with ResultWriter(gridstore, ['tariff', 'AVE', *eq_grid, *welf_res]) as writer:
+    writer.append(tariff=tar_grid, AVE=opt_tar_toplot["AVE"], **eq_grid, **welf_res)
 
 # plot results 
 # tariff pedagogy
-opt_tar_plot(opt_tar_toplot, key = 'welf', ylabel = 'Importer welfare')
-opt_tar_plot(opt_tar_toplot, key='rev', ylabel = 'Tariff revenue')
-opt_tar_plot(opt_tar_toplot, key='dCS', ylabel = 'Consumer welfare')
-opt_tar_plot(opt_tar_toplot, key='dPS', ylabel = 'Producer surplus')
-opt_tar_plot(opt_tar_toplot, key='ToT', ylabel = 'Terms of Trade')
-
-# find optimal tariff (note: the plotting function does the same)
-idx = opt_tar_toplot["welf"].index(max(opt_tar_toplot["welf"]))
-opt_tar = opt_tar_toplot["tar"][idx]
-opt_tar_ave = opt_tar_toplot["AVE"][idx]
-opt_tar_welf = opt_tar_toplot["welf"][idx]
+if FIGURES:
+    for key, ylabel in [('welf', 'Importer welfare'), ('rev', 'Tariff revenue'),
+                        ('dCS', 'Consumer welfare'), ('dPS', 'Producer surplus'),
+                        ('ToT', 'Terms of Trade')]:
+        plot_jobs.append({'plot': 'opt_tar', 'data': opt_tar_toplot, 
+                          'key': key, 'ylabel': ylabel})
+    render(plot_jobs)
+
+# find optimal tariff (note: the plotting function reads it off the grid above)
+opt = mod.find_optimal_tariff(tariff_type=mod.TAR_type)
+opt_tar = opt['tariff']
+opt_tar_ave = opt['ave']
+opt_tar_welf = opt['welf']
 
 # If the weighst for the 3 welfare components are not equal, we get something different. 
 # E.g put more weight on consumers and producers than on revenue: 
 weights = np.array([4, 3, 2])
 weights = weights/weights.sum() # to make sure they sum to unity
 
-# weighted sum as product of matrix and vector of weights
-welf_weighted =  np.array([opt_tar_toplot['dCS'],
-                 opt_tar_toplot['dPS'],
-                 opt_tar_toplot['rev']]).T@weights
-                  
-idx = np.where(welf_weighted == max(welf_weighted))[0][0]
-opt_tar_ave_weighted = opt_tar_toplot["AVE"][idx]
+# weighted sum of the welfare components 
+opt_weighted = mod.find_optimal_tariff(tariff_type=mod.TAR_type, 
+                            objective=dict(zip(['dCS', 'dPS', 'dRev'], weights)))
+opt_tar_ave_weighted = opt_weighted['ave']
 
 def create_rep(txtfile=False, **kwargs):
       tmp_stdout = sys.stdout
       if txtfile == True:
             
             fname = kwargs["fname"]
+            init.make_dirs()
             fullfname = Path(Path(__file__).parent) / f"{mod.TEXTPATH}/{fname}"
             try:
                   fullfname.unlink()
@@ -154,10 +167,12 @@ def create_rep(txtfile=False, **kwargs):
             print(f"Optimal tariff for unequal weights (dCS, dPS, dRev): "
                   f"{[round(w,2) for w in weights]} "
                   f"AVE: {opt_tar_ave_weighted:.0%}"
-                  f"\nWeighted welfare outcome: {max(welf_weighted):.2f}")
+                  f"\nWeighted welfare outcome: {opt_weighted['welf']:.2f}")
 
             print(f"\nModel parameters read from: {Path(mod.PARPATH/mod.PARFILE)}\n")
-            print(f"A bunch of figures saved in: {FIGPATH}")
+            if FIGURES:
+                  print(f"A bunch of figures saved in: {mod.FIGPATH}")
+            print(f"Tariff grid results stored in: {gridstore}")
             print(f"And this report has made it to: {fullfname}")
             print('\n','*'*10, 'END','*'*10,'\n')
 
@@ -166,5 +181,14 @@ def create_rep(txtfile=False, **kwargs):
 create_rep()   
 create_rep(txtfile=True, fname = f"{mod.PARFILE.stem}_out.txt")   
 
+# python runmodel.py --explore opens the equilibrium figure with a tariff 
+# slider (needs an interactive matplotlib backend)
+if FIGURES and '--explore' in sys.argv:
+    import matplotlib.pyplot as plt
+    from plots import TariffExplorer
+
+    explorer = TariffExplorer.from_model(mod.default_model(), valinit=mod.TAR_val)
+    plt.show()
+
 
 # %%
@@ -0,0 +1,466 @@
+# service.py
+"""Local query service for equilibria, welfare and optimal tariffs
+
+A long-lived asyncio server on a Unix socket (or a local TCP port) that
+answers requests for single (parameter set, tariff) pairs, without paying
+for imports and solving on every query. It runs offline and only uses the
+standard library next to the model.
+
+Protocol: one JSON object per line in, one per line out. Requests
+
+    {"id": 1, "op": "welfare", "calibration": "linlog.json", "tariff": 0.2}
+    {"id": 2, "op": "optimal", "params": {...}, "tartype": "Specific"}
+
+op:          "trademodel": the equilibrium (keys of TradeModel.trademodel)
+             "welfare":    the equilibrium, home_welf, foreign_welf and
+                           world_welf, relative to free trade
+             "optimal":    TradeModel.find_optimal_tariff, with an optional
+                           "objective" (a key of home_welf, default "total")
+             "ping", "stats"
+calibration: a parameter file in PARPATH, or
+params:      a parameter dict as in the files (missing keys from DEFAULTS)
+tariff, tartype: default to TAR_val and TAR_type of the parameters
+Answers carry the request's "id", and "ok" with either "result" or "error".
+Lines longer than LINE_LIMIT bytes, and scenarios without a finite
+solution, are answered with an error.
+Requests on one connection may be answered out of order.
+
+Answers are cached, so repeated scenarios are dictionary lookups. Other
+requests go to a bounded queue, which a single solver drains in batches:
+all queued requests of one SYSTEM and tariff type are solved at once as a
+uq.SampleModel, whatever their parameters. Concurrent requests thus
+coalesce into vectorized solves. Tables (SYSTEM "tab") do not stack, their
+requests are solved per table, for all their tariffs at once. When the queue is full, connections stop
+being read (backpressure), and each connection has at most max_inflight
+requests in progress.
+
+    python service.py --unix /tmp/pe_model.sock
+    python service.py --port 8765
+
+    with Client('/tmp/pe_model.sock') as c:
+        c.query(op='welfare', calibration='linear.json', tariff=0.3)
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import pe_model as mod
+import init
+from uq import SampleModel
+from kitchen import LRUCache, freeze
+
+OPS = ['trademodel', 'welfare', 'optimal', 'ping', 'stats']
+SECTIONS = ["homedem_pars", "homesup_pars", "forsup_pars"]
+# longest request line read, in bytes
+LINE_LIMIT = 2**20
+
+
+class RequestError(ValueError):
+    ''' A request that cannot be answered, reported back to the client'''
+
+
+################################################################
+# solving batches of requests
+################################################################
+
+def stack_params(params_list):
+    ''' Returns the parameters of a list of parameter dicts as one
+    parameter dict of (m, 1) arrays, for a SampleModel'''
+    first = params_list[0]
+    stacked = {k: v for k, v in first.items() if k not in SECTIONS}
+    for section in SECTIONS:
+        stacked[section] = {k: np.array([[p[section][k]] for p in params_list], dtype=float)
+                            for k in first[section]}
+    return stacked
+
+
+def solve_equil(params_list, tartype, tariffs):
+    ''' Solves the equilibrium and welfare of every (parameters, tariff) pair
+    at once. All parameter dicts must share SYSTEM. Tables ('tab') do not
+    stack: all parameter dicts are then the same table, solved for all
+    tariffs by TradeModel.trademodel_batch. Returns a list of dicts
+    with 'equil', 'home_welf', 'foreign_welf', 'world_welf' and 'pw' '''
+    if params_list[0]["SYSTEM"] == 'tab':
+        model = mod.TradeModel(params_list[0])
+        t = mod.create_tar_instance(tartype, np.asarray(tariffs, dtype=float))
+        p_t = model.trademodel_batch(tariffs, tartype)['pstar_t']
+    else:
+        model = SampleModel(stack_params(params_list))
+        t = mod.create_tar_instance(tartype, np.reshape(tariffs, (-1, 1)))
+        p_t = model.equil_price(t)
+    P0, Q0 = model.home_notrade_equil()
+    pw, _ = model.free_trade_equil()
+    xstar = model.expsup(p_t, t)
+    pstar = model.expprice(xstar)               # as in TradeModel.trademodel
+    equil = {'pstar_t': p_t, 'pstar': pstar, 'mstar': model.impdem(p_t),
+             'xstar': xstar, 'dstar': model.homedem(p_t),
+             'sstar': model.homesup(p_t), 'P0': P0, 'Q0': Q0}
+    w_home = model.home_welf(pw, p_t, pstar)
+    w_fore = model.foreign_welf(pw, pstar)
+    res = {'equil': equil, 'home_welf': w_home, 'foreign_welf': w_fore,
+           'world_welf': mod.world_welf(w_home, w_fore), 'pw': {'pw': pw}}
+    # one value per request
+    res = {part: {k: np.broadcast_to(v, np.shape(p_t)).ravel() for k, v in d.items()}
+           for part, d in res.items()}
+    pw = res.pop('pw')['pw']
+    return [finite_or_error({**{part: {k: float(v[i]) for k, v in d.items()}
+                                for part, d in res.items()},
+                             'pw': float(pw[i])})
+            for i in range(len(params_list))]
+
+
+def solve_optimal(params_list, tartype, objective):
+    ''' Finds the optimal tariff of every parameter dict at once, see
+    SampleModel.find_optimal_tariff, or of the one table of 'tab' (see
+    solve_equil). Returns a list of dicts'''
+    if params_list[0]["SYSTEM"] == 'tab':
+        opt = mod.TradeModel(params_list[0]).find_optimal_tariff(tartype, objective)
+        res = finite_or_error({'tariff': float(opt['tariff']), 'ave': float(opt['ave']),
+                               'welf': float(opt['welf']), 'success': bool(opt['success'])})
+        return [res]*len(params_list)
+    model = SampleModel(stack_params(params_list))
+    opt = model.find_optimal_tariff(tartype, objective)
+    return [finite_or_error({'tariff': float(opt['tariff'][i, 0]), 'ave': float(opt['ave'][i, 0]),
+                             'welf': float(opt['welf'][i, 0]),
+                             'success': bool(opt['success'][i, 0])})
+            for i in range(len(params_list))]
+
+
+def finite_or_error(res):
+    ''' Returns res, or a RequestError when any of its numbers is not finite:
+    degenerate parameters, or no converged equilibrium (the solves of 
+    SampleModel give nan then). JSON has no inf and nan'''
+    values = [v for d in res.values() for v in (d.values() if isinstance(d, dict) else [d])]
+    if not np.all(np.isfinite(values)):
+        return RequestError("No finite solution for these parameters")
+    return res
+
+
+################################################################
+# the service
+################################################################
+
+class ModelService():
+    ''' Answers requests (dicts, see the module docstring) with submit(),
+    and serves them over sockets with serve().
+
+    maxqueue: requests waiting to be solved, beyond which submit() waits
+    max_batch: largest number of requests solved at once
+    cache_size: number of answers kept
+    max_inflight: requests in progress per connection
+    '''
+
+    def __init__(self, maxqueue=1024, max_batch=4096, cache_size=100_000, max_inflight=64):
+        self.max_batch = max_batch
+        self.max_inflight = max_inflight
+        self.cache = LRUCache(maxsize=cache_size)
+        self.calibrations = {}
+        self.queue = None
+        self.maxqueue = maxqueue
+        self._pending = {}
+        self._solver = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.counts = {'requests': 0, 'errors': 0, 'batches': 0, 'solved': 0}
+
+    def calibration(self, name):
+        ''' Returns the parameters of parameter file name, read once.
+        Only plain file names of files in PARPATH are served'''
+        if not isinstance(name, str) or Path(name).name != name:
+            raise RequestError(f"Unknown calibration: {name}")
+        if name not in self.calibrations:
+            path = init.PARPATH / name
+            if not path.is_file():
+                raise RequestError(f"Unknown calibration: {name}")
+            try:
+                with open(path, 'r') as openfile:
+                    self.calibrations[name] = {**mod.DEFAULTS, **json.load(openfile)}
+            except (OSError, ValueError) as err:
+                raise RequestError(f"Cannot read calibration {name}: {err}")
+        return self.calibrations[name]
+
+    def scenario(self, req):
+        ''' Returns the cache key, parameters, tariff type, tariff value and
+        objective of request req'''
+        if 'calibration' in req:
+            params = self.calibration(req['calibration'])
+        else:
+            params = {**mod.DEFAULTS, **req.get('params', {})}
+        if params["SYSTEM"] not in mod.funcs:
+            raise RequestError(f"Unknown SYSTEM: {params['SYSTEM']}")
+        tartype = req.get('tartype', params["TAR_type"])
+        if tartype not in ['Ave', 'Specific']:
+            raise RequestError(f"Unknown tariff type: {tartype}")
+        try:
+            tariff = float(req.get('tariff', params["TAR_val"]))
+            if params["SYSTEM"] == 'tab':
+                # tables of points p and q
+                pars = {s: {k: [float(x) for x in v] for k, v in params[s].items()}
+                        for s in SECTIONS}
+            else:
+                pars = {s: {k: float(v) for k, v in params[s].items()} for s in SECTIONS}
+        except (TypeError, ValueError, AttributeError):
+            raise RequestError("Tariff and parameters must be numbers")
+        objective = req.get('objective', 'total')
+        if not isinstance(objective, str):
+            raise RequestError("objective must be a key of home_welf")
+
+        op = req['op']
+        params = {"SYSTEM": params["SYSTEM"], **pars}
+        if op == 'optimal':
+            key = (op, freeze(params), tartype, objective)
+        else:
+            key = ('equil', freeze(params), tartype, tariff)
+        return key, params, tartype, tariff, objective
+
+    async def submit(self, req):
+        ''' Answers request req, a dict. Returns the answer dict'''
+        self.counts['requests'] += 1
+        ident = req.get('id') if isinstance(req, dict) else None
+        try:
+            if not isinstance(req, dict) or req.get('op') not in OPS:
+                raise RequestError(f"op must be one of {OPS}")
+            op = req['op']
+            if op == 'ping':
+                result = 'pong'
+            elif op == 'stats':
+                result = self.stats()
+            else:
+                key, params, tartype, tariff, objective = self.scenario(req)
+                res = self.cache.get(key)
+                if res is None:
+                    res = await self._solve(key, params, tartype, tariff, objective)
+                result = res['equil'] if op == 'trademodel' else res
+            return {'id': ident, 'ok': True, 'result': result}
+        except RequestError as err:
+            self.counts['errors'] += 1
+            return {'id': ident, 'ok': False, 'error': str(err)}
+        except (TypeError, KeyError) as err:
+            # malformed requests, e.g. params that are not a dict
+            self.counts['errors'] += 1
+            return {'id': ident, 'ok': False, 'error': f"Invalid request: {err!r}"}
+
+    async def _solve(self, key, params, tartype, tariff, objective):
+        # identical scenarios in progress share one solution
+        fut = self._pending.get(key)
+        if fut is None:
+            if self._solver is None:
+                self.start()
+            fut = asyncio.get_running_loop().create_future()
+            self._pending[key] = fut
+            # waits while the queue is full: backpressure on the caller
+            await self.queue.put((key, params, tartype, tariff, objective, fut))
+        return await asyncio.shield(fut)
+
+    def start(self):
+        ''' Starts the solver task, in the running event loop'''
+        self.queue = asyncio.Queue(maxsize=self.maxqueue)
+        self._solver = asyncio.get_running_loop().create_task(self._solve_batches())
+
+    async def _solve_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self.queue.get()]
+            while len(jobs) < self.max_batch and not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
+
+            groups = {}
+            for job in jobs:
+                key, params, tartype, tariff, objective, fut = job
+                # requests solved together share functions and parameter names,
+                # tables do not stack: one group per table
+                names = tuple(tuple(sorted(params[s])) for s in SECTIONS)
+                if params["SYSTEM"] == 'tab':
+                    names = freeze(params)
+                gkey = (params["SYSTEM"], names, tartype, key[0],
+                        objective if key[0] == 'optimal' else None)
+                groups.setdefault(gkey, []).append(job)
+
+            for (system, names, tartype, kind, objective), group in groups.items():
+                params_list = [job[1] for job in group]
+                try:
+                    # solved off the event loop, which keeps answering cached requests
+                    if kind == 'optimal':
+                        results = await loop.run_in_executor(
+                            self._executor, solve_optimal, params_list, tartype, objective)
+                    else:
+                        tariffs = np.array([job[3] for job in group])
+                        results = await loop.run_in_executor(
+                            self._executor, solve_equil, params_list, tartype, tariffs)
+                except Exception as err:
+                    results = [RequestError(f"{type(err).__name__}: {err}")]*len(group)
+                self.counts['batches'] += 1
+                self.counts['solved'] += len(group)
+
+                for (key, *_, fut), res in zip(group, results):
+                    self._pending.pop(key, None)
+                    if isinstance(res, Exception):
+                        fut.set_exception(res)
+                    else:
+                        self.cache.put(key, res)
+                        fut.set_result(res)
+            for _ in jobs:
+                self.queue.task_done()
+
+    def stats(self):
+        ''' Returns counters of requests, batches and the cache'''
+        batches = max(self.counts['batches'], 1)
+        return {**self.counts, 'mean_batch': self.counts['solved'] / batches,
+                'queued': 0 if self.queue is None else self.queue.qsize(),
+                'cache': self.cache.info()}
+
+    ################################################################
+    # sockets
+    ################################################################
+
+    async def handle(self, reader, writer):
+        ''' Serves one connection'''
+        inflight = asyncio.Semaphore(self.max_inflight)
+        tasks = set()
+
+        async def answer(line):
+            try:
+                try:
+                    if line is None:
+                        raise RequestError(f"Request line longer than {LINE_LIMIT} bytes")
+                    req = json.loads(line)
+                except ValueError as err:
+                    self.counts['errors'] += 1
+                    error = str(err) if isinstance(err, RequestError) else "Invalid JSON"
+                    res = {'id': None, 'ok': False, 'error': error}
+                else:
+                    res = await self.submit(req)
+                try:
+                    out = json.dumps(res, allow_nan=False)
+                except ValueError:
+                    out = json.dumps({'id': res.get('id'), 'ok': False,
+                                      'error': "Result is not finite"})
+                writer.write(out.encode() + b"\n")
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                inflight.release()
+
+        try:
+            while True:
+                # stop reading while max_inflight requests are in progress
+                await inflight.acquire()
+                line = await read_line(reader)
+                if line == b"":
+                    inflight.release()
+                    break
+                task = asyncio.create_task(answer(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path=None, host='127.0.0.1', port=None, calibrations=()):
+        ''' Serves on Unix socket path, or on host:port, until cancelled.
+        calibrations: parameter files to read and solve before serving'''
+        self.start()
+        for name in calibrations:
+            await self.submit({'op': 'welfare', 'calibration': name})
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=path, limit=LINE_LIMIT)
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port,
+                                                limit=LINE_LIMIT)
+        where = path if path is not None else f"{host}:{port}"
+        print(f"****** pe_model service listening on {where}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+async def read_line(reader):
+    ''' Returns the next line of reader, b"" at the end of the stream, and
+    None for a line longer than the stream's limit, which is skipped'''
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as err:
+        # the last line, without newline
+        return err.partial
+    except asyncio.LimitOverrunError as err:
+        consumed = err.consumed
+    # drop the line up to its newline, chunk by chunk
+    while True:
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b"\n")
+            return None
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError as err:
+            consumed = err.consumed
+
+
+class Client():
+    ''' Blocking client of the service, for scripts and tools'''
+
+    def __init__(self, path=None, host='127.0.0.1', port=None, timeout=60.):
+        if path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(str(path))
+        else:
+            self.sock = socket.create_connection((host, port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+        self.file = self.sock.makefile('rb')
+        self._id = 0
+
+    def query(self, **req):
+        ''' Sends one request, returns its result. Raises RequestError
+        when the service reports an error'''
+        self._id += 1
+        req.setdefault('id', self._id)
+        self.sock.sendall(json.dumps(req).encode() + b"\n")
+        res = json.loads(self.file.readline())
+        if not res['ok']:
+            raise RequestError(res['error'])
+        return res['result']
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local query service of pe_model")
+    parser.add_argument('--unix', help="path of the Unix socket to listen on")
+    parser.add_argument('--host', default='127.0.0.1', help="host to listen on (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port (default 8765)")
+    parser.add_argument('--calibrations', default='',
+                        help="comma separated parameter files to warm up")
+    parser.add_argument('--maxqueue', type=int, default=1024, help="requests waiting to be solved")
+    parser.add_argument('--cache-size', type=int, default=100_000, help="answers kept")
+    args = parser.parse_args(argv)
+
+    service = ModelService(maxqueue=args.maxqueue, cache_size=args.cache_size)
+    calibrations = [c for c in args.calibrations.split(',') if c]
+    try:
+        asyncio.run(service.serve(args.unix, args.host, args.port, calibrations))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# solvers.py
+"""Vectorized bracketing root finders for the scalar equilibrium conditions,
+and a bracketing minimizer
+
+All functions but brent() work element-wise on NumPy arrays (and on plain
+floats), so that a whole grid of equilibrium conditions, e.g. one per tariff
+value, is solved in a single pass of array operations. brent() solves one
+scalar equation, for the single equilibria.
+"""
+
+import numpy as np
+
+
+def bracket(func, lo, hi, grow=2.0, maxiter=60):
+    ''' Widens the interval [lo, hi] until func changes sign on it.
+    Assumes func is decreasing in x and x > 0 (prices): hi is multiplied
+    by grow while func(hi) > 0, lo is divided by grow while func(lo) < 0.
+
+    Returns:
+    lo, hi, func(lo), func(hi) as arrays
+    '''
+    lo = np.array(lo, dtype=float)
+    hi = np.array(hi, dtype=float)
+    lo, hi = np.broadcast_arrays(np.minimum(lo, hi), np.maximum(lo, hi))
+    lo, hi = lo.copy(), hi.copy()
+
+    flo, fhi = func(lo), func(hi)
+    for _ in range(maxiter):
+        up, down = fhi > 0, flo < 0
+        if not (up.any() or down.any()):
+            break
+        hi = np.where(up, hi*grow, hi)
+        lo = np.where(down, lo/grow, lo)
+        flo, fhi = func(lo), func(hi)
+
+    return lo, hi, flo, fhi
+
+
+def illinois(func, lo, hi, flo=None, fhi=None, xtol=1e-12, maxiter=100):
+    ''' Illinois variant of regula falsi, element-wise on arrays.
+
+    func(x) must accept arrays and have opposite signs at lo and hi.
+    The bracket is kept at every step, so the solution never leaves [lo, hi].
+    Every third step is a bisection where the last three steps did not halve
+    the bracket, so that wide brackets of steep functions converge as well.
+
+    Returns:
+    x : array of roots
+    nit : number of iterations used
+    converged : boolean array
+    '''
+    lo = np.array(lo, dtype=float)
+    hi = np.array(hi, dtype=float)
+    flo = func(lo) if flo is None else np.array(flo, dtype=float)
+    fhi = func(hi) if fhi is None else np.array(fhi, dtype=float)
+    lo, hi, flo, fhi = [a.copy() for a in np.broadcast_arrays(lo, hi, flo, fhi)]
+
+    side = np.zeros(lo.shape, dtype=np.int8)
+    bisect = np.zeros(lo.shape, dtype=bool)
+    x = np.where(flo == 0, lo, hi)
+    done = (flo == 0) | (fhi == 0)
+    nit = 0
+    for nit in range(1, maxiter + 1):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x_new = (lo*fhi - hi*flo) / (fhi - flo)
+        # fall back to bisection when the secant is not defined
+        x_new = np.where(np.isfinite(x_new) & ~bisect, x_new, 0.5*(lo + hi))
+        x = np.where(done, x, x_new)
+        if nit % 3 == 1:
+            width = hi - lo         # bracket three steps back
+        fx = func(x)
+
+        left = np.sign(fx) == np.sign(flo)      # root lies in [x, hi]
+        keep = ~done
+        # Illinois step: halve the value at the end point retained twice
+        fhi = np.where(keep & left & (side == 1), fhi/2, fhi)
+        flo = np.where(keep & ~left & (side == -1), flo/2, flo)
+
+        lo = np.where(keep & left, x, lo)
+        flo = np.where(keep & left, fx, flo)
+        hi = np.where(keep & ~left, x, hi)
+        fhi = np.where(keep & ~left, fx, fhi)
+        side = np.where(left, 1, -1).astype(np.int8)
+        bisect = (nit % 3 == 0) & ((hi - lo) > 0.5*width)
+
+        done = done | (fx == 0) | (np.abs(hi - lo) <= xtol*(1. + np.abs(x)))
+        if done.all():
+            break
+
+    return x, nit, done
+
+
+def newton(func, x0, xtol=1e-12, maxiter=20):
+    ''' Newton's method, element-wise on arrays.
+
+    func(x) must return the pair (f(x), f'(x)). Meant to polish a good
+    starting guess x0, there is no bracket: an element whose step is not 
+    finite or leaves x > 0 is flagged as not converged and left at x0, 
+    for the caller to fall back on bracket() and illinois().
+
+    Returns:
+    x : array of roots
+    nit : number of iterations used
+    converged : boolean array
+    '''
+    x0 = np.array(x0, dtype=float)
+    x = x0.copy()
+    done = np.zeros(x.shape, dtype=bool)
+    failed = np.zeros(x.shape, dtype=bool)
+    nit = 0
+    for nit in range(1, maxiter + 1):
+        fx, dfx = func(x)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            step = np.where(fx == 0, 0., fx / dfx)
+        x_new = x - step
+        failed = failed | (~done & ~(np.isfinite(x_new) & (x_new > 0)))
+        active = ~done & ~failed
+        x = np.where(active, x_new, x)
+        done = done | (active & (np.abs(step) <= xtol*(1. + np.abs(x))))
+        if (done | failed).all():
+            break
+
+    x = np.where(failed, x0, x)
+    return x, nit, done
+
+
+def golden(func, lo, hi, xtol=1e-8, maxiter=200):
+    ''' Golden section search for the minimum of func on [lo, hi],
+    element-wise on arrays. func must be unimodal on the interval.
+
+    Returns:
+    x : array of minimizers
+    nit : number of iterations used
+    converged : boolean array, |hi - lo| <= xtol
+    '''
+    invphi = (np.sqrt(5.) - 1.) / 2.
+    lo = np.array(lo, dtype=float)
+    hi = np.array(hi, dtype=float)
+    lo, hi = [a.copy() for a in np.broadcast_arrays(lo, hi)]
+
+    c = hi - invphi*(hi - lo)
+    d = lo + invphi*(hi - lo)
+    fc, fd = func(c), func(d)
+    nit = 0
+    for nit in range(1, maxiter + 1):
+        if (np.abs(hi - lo) <= xtol).all():
+            break
+        left = fc < fd                          # minimum lies in [lo, d]
+        hi = np.where(left, d, hi)
+        lo = np.where(left, lo, c)
+        # one of the interior points is reused, the other is new
+        c_new = np.where(left, hi - invphi*(hi - lo), d)
+        d_new = np.where(left, c, lo + invphi*(hi - lo))
+        f_new = func(np.where(left, c_new, d_new))
+        fc, fd = np.where(left, f_new, fd), np.where(left, fc, f_new)
+        c, d = c_new, d_new
+
+    x = np.where(fc < fd, c, d)
+    return x, nit, np.abs(hi - lo) <= xtol
+
+
+class SolverError(RuntimeError):
+    ''' Raised when a root finder cannot find a bracket or does not converge'''
+
+
+def brent(func, lo, hi, flo=None, fhi=None, xtol=1e-12, rtol=4*np.finfo(float).eps,
+          maxiter=100):
+    ''' Brent's method for a root of the scalar function func on [lo, hi],
+    where func must change sign. Combines bisection, secant and inverse
+    quadratic interpolation steps, and keeps the bracket, so it converges
+    whenever the bracket is valid (as scipy.optimize.brentq).
+
+    Returns:
+    x : the root, to within xtol + rtol*|x|
+    nit : number of iterations used
+    converged : bool
+    '''
+    xpre, xcur = float(lo), float(hi)
+    fpre = float(func(xpre)) if flo is None else float(flo)
+    fcur = float(func(xcur)) if fhi is None else float(fhi)
+    if fpre*fcur > 0:
+        raise SolverError(f"No sign change on [{xpre:.6g}, {xcur:.6g}]")
+    if fpre == 0:
+        return xpre, 0, True
+    if fcur == 0:
+        return xcur, 0, True
+
+    xblk = fblk = spre = scur = 0.
+    for nit in range(1, maxiter + 1):
+        if fpre*fcur < 0:
+            # xblk is the other end of the bracket
+            xblk, fblk = xpre, fpre
+            spre = scur = xcur - xpre
+        if abs(fblk) < abs(fcur):
+            xpre, xcur, xblk = xcur, xblk, xcur
+            fpre, fcur, fblk = fcur, fblk, fcur
+
+        delta = (xtol + rtol*abs(xcur)) / 2
+        sbis = (xblk - xcur) / 2
+        if fcur == 0 or abs(sbis) < delta:
+            return xcur, nit, True
+
+        if abs(spre) > delta and abs(fcur) < abs(fpre):
+            if xpre == xblk:
+                # secant
+                stry = -fcur*(xcur - xpre)/(fcur - fpre)
+            else:
+                # inverse quadratic interpolation
+                dpre = (fpre - fcur)/(xpre - xcur)
+                dblk = (fblk - fcur)/(xblk - xcur)
+                stry = -fcur*(fblk*dblk - fpre*dpre)/(dblk*dpre*(fblk - fpre))
+            if 2*abs(stry) < min(abs(spre), 3*abs(sbis) - delta):
+                spre, scur = scur, stry
+            else:
+                spre, scur = sbis, sbis
+        else:
+            spre, scur = sbis, sbis
+
+        xpre, fpre = xcur, fcur
+        xcur += scur if abs(scur) > delta else (delta if sbis > 0 else -delta)
+        fcur = float(func(xcur))
+
+    return xcur, maxiter, False
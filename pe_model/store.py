@@ -0,0 +1,145 @@
+# store.py
+"""Streaming columnar storage of model results
+
+ResultWriter appends rows of named columns and writes them out in chunks
+of chunksize rows, so the memory used while writing is bounded by the
+chunk size, however many rows are written. Formats:
+    'bin':     a directory with one raw float64 file per column and a
+               meta.json, read back as memory maps by read_results()
+    'csv':     one csv file with a header line
+    'parquet': one parquet file with one row group per chunk (needs pyarrow)
+The format follows from the suffix of the path (.csv, .parquet) unless
+given, anything else is 'bin'.
+
+    with ResultWriter(path, ['tariff', 'pstar_t', 'total']) as w:
+        for ...:
+            w.append(tariff=t, pstar_t=eq['pstar_t'], total=welf['total'])
+    res = read_results(path)          # dict of columns
+
+'bin' results are readable up to the last complete chunk while they are
+still being written, e.g. when a long sweep was interrupted.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+FORMATS = ['bin', 'csv', 'parquet']
+
+
+def get_format(path, fmt=None):
+    ''' Returns fmt, or the format implied by the suffix of path'''
+    if fmt is None:
+        fmt = {'.csv': 'csv', '.parquet': 'parquet'}.get(Path(path).suffix, 'bin')
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}, expected one of {FORMATS}")
+    return fmt
+
+
+class ResultWriter():
+    ''' Writes rows of the columns fields to path, in chunks of chunksize rows.
+    Existing results at path are overwritten. Use as a context manager,
+    or call close() when done'''
+
+    def __init__(self, path, fields, chunksize=4096, fmt=None):
+        self.path = Path(path)
+        self.fields = list(fields)
+        self.chunksize = chunksize
+        self.fmt = get_format(path, fmt)
+        self.nrows = 0                  # rows written to disk
+        self._buf = {k: [] for k in self.fields}
+        self._nbuf = 0
+
+        if self.fmt == 'bin':
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._files = {k: open(self.path / f"{k}.f8", 'wb') for k in self.fields}
+            self._write_meta()
+        elif self.fmt == 'csv':
+            self._file = open(self.path, 'w')
+            self._file.write(",".join(self.fields) + "\n")
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self._pa = pa
+            schema = pa.schema([(k, pa.float64()) for k in self.fields])
+            self._writer = pq.ParquetWriter(str(self.path), schema)
+
+    def _write_meta(self):
+        with open(self.path / "meta.json", 'w') as openfile:
+            json.dump({'fields': self.fields, 'nrows': self.nrows, 'dtype': '<f8'}, openfile)
+
+    def append(self, **columns):
+        ''' Appends rows: one value or array per field, all broadcast to
+        a common length'''
+        missing = set(self.fields) - set(columns)
+        if missing:
+            raise KeyError(f"Missing columns: {sorted(missing)}")
+        cols = np.broadcast_arrays(*[np.ravel(np.asarray(columns[k], dtype=float))
+                                     for k in self.fields])
+        for k, c in zip(self.fields, cols):
+            self._buf[k].append(np.array(c))
+        self._nbuf += cols[0].size
+        if self._nbuf >= self.chunksize:
+            self.flush()
+
+    def flush(self):
+        ''' Writes the buffered rows'''
+        if self._nbuf == 0:
+            return
+        cols = {k: np.concatenate(self._buf[k]) for k in self.fields}
+        if self.fmt == 'bin':
+            for k in self.fields:
+                cols[k].astype('<f8').tofile(self._files[k])
+                self._files[k].flush()
+        elif self.fmt == 'csv':
+            np.savetxt(self._file, np.column_stack([cols[k] for k in self.fields]),
+                       delimiter=',', fmt='%.17g')
+        else:
+            self._writer.write_table(self._pa.table(cols))
+
+        self.nrows += self._nbuf
+        self._buf = {k: [] for k in self.fields}
+        self._nbuf = 0
+        if self.fmt == 'bin':
+            self._write_meta()
+
+    def close(self):
+        self.flush()
+        if self.fmt == 'bin':
+            for f in self._files.values():
+                f.close()
+        elif self.fmt == 'csv':
+            self._file.close()
+        else:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def read_results(path, fmt=None):
+    ''' Reads results written by ResultWriter. Returns a dict of columns:
+    read-only memory maps for 'bin' (and parquet, as far as pyarrow can),
+    arrays for 'csv' '''
+    path = Path(path)
+    fmt = get_format(path, fmt)
+    if fmt == 'bin':
+        with open(path / "meta.json", 'r') as openfile:
+            meta = json.load(openfile)
+        n = meta['nrows']
+        if n == 0:
+            return {k: np.empty(0) for k in meta['fields']}
+        return {k: np.memmap(path / f"{k}.f8", dtype=meta['dtype'], mode='r', shape=(n,))
+                for k in meta['fields']}
+    elif fmt == 'csv':
+        data = np.genfromtxt(path, delimiter=',', names=True, ndmin=1, deletechars='')
+        return {k: data[k] for k in data.dtype.names}
+    else:
+        import pyarrow.parquet as pq
+        table = pq.read_table(str(path), memory_map=True)
+        return {k: table.column(k).to_numpy() for k in table.column_names}
@@ -0,0 +1,208 @@
+# sweep.py
+"""Parallel sweeps of the model over grids of parameters and tariffs
+
+Every combination of the parameter grid is a TradeModel, solved for the whole
+vector of tariffs with trademodel_batch() and home_welf(). Combinations are
+fanned out in chunks to a process pool. The workers write their results
+straight into shared-memory NumPy arrays, so nothing but chunk bounds
+travels between processes.
+
+With store=path the results are streamed to disk (see store.py) block by
+block, so memory stays bounded for sweeps of any size.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from multiprocessing import shared_memory
+import os
+
+import numpy as np
+
+import pe_model as mod
+from store import ResultWriter, read_results
+
+# results per parameter combination and tariff
+FIELDS = ['pstar_t', 'pstar', 'mstar', 'xstar', 'dstar', 'sstar',
+          'dCS', 'dPS', 'dRev', 'ToT', 'total', 'AVE']
+# results per parameter combination, with optimal=True
+OPT_FIELDS = ['opt_tariff', 'opt_ave', 'opt_welf']
+
+# set in each worker by _init_worker()
+_worker = {}
+
+
+def param_axes(grid):
+    ''' Flattens a parameter grid into a list of (section, name, values), e.g.
+    {'homedem_pars': {'slope': [-10, -15]}} -> [('homedem_pars', 'slope', array([-10, -15]))]'''
+    return [(section, name, np.asarray(values, dtype=float))
+            for section, pars in grid.items()
+            for name, values in pars.items()]
+
+
+def grid_params(base, axes, i):
+    ''' Returns the parameter dict of combination i of the grid'''
+    shape = tuple(len(v) for _, _, v in axes)
+    idx = np.unravel_index(i, shape)
+    params = {k: (dict(v) if isinstance(v, dict) else v) for k, v in base.items()}
+    for (section, name, values), j in zip(axes, idx):
+        params[section][name] = float(values[j])
+    return params
+
+
+def _attach(name, shape):
+    # workers share the resource tracker of the creating process, 
+    # which unlinks the block
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+
+def _init_worker(spec):
+    _worker.clear()
+    _worker.update(spec)
+    _worker['shm'], _worker['out'] = _attach(spec['out_name'], spec['out_shape'])
+    if spec['opt_name'] is not None:
+        _worker['opt_shm'], _worker['opt'] = _attach(spec['opt_name'], spec['opt_shape'])
+
+
+def _run_chunk(start, stop, offset=0):
+    ''' Solves combinations start ... stop-1 and writes them to shared memory,
+    at positions start-offset ... stop-offset-1'''
+    w = _worker
+    tariffs, tartype = w['tariffs'], w['tariff_type']
+    out = w['out']
+    for i in range(start, stop):
+        model = mod.TradeModel(grid_params(w['base'], w['axes'], i))
+        pw, _ = model.free_trade_equil()
+        if w['continuation']:
+            eq = model.trademodel_path(tariffs, tartype)
+        else:
+            eq = model.trademodel_batch(tariffs, tartype)
+        welf = model.home_welf(pw, eq['pstar_t'], eq['pstar'])
+        res = {**eq, **welf}
+        res['AVE'] = mod.create_tar_instance(tartype, tariffs).ave(eq['pstar_t'])
+        for k, field in enumerate(FIELDS):
+            out[k, i - offset, :] = res[field]
+        if w['optimal']:
+            opt = model.find_optimal_tariff(tartype)
+            w['opt'][:, i - offset] = opt['tariff'], opt['ave'], opt['welf']
+    return stop - start
+
+
+def store_fields(axes, optimal=False):
+    ''' Returns the columns of a stored sweep: one per grid parameter
+    ('section.name'), the tariff, the FIELDS and with optimal=True the OPT_FIELDS'''
+    return ([f"{section}.{name}" for section, name, _ in axes] + ['tariff']
+            + FIELDS + (OPT_FIELDS if optimal else []))
+
+
+def sweep(grid, tariffs, tariff_type='Ave', base=None, optimal=False,
+          workers=None, chunksize=64, continuation=False, store=None, block=None):
+    ''' Solves the model for every combination of the parameter grid and
+    every tariff in tariffs.
+
+    grid: values to combine per parameter, e.g.
+          {'homedem_pars': {'slope': [-10, -15, -20]},
+           'forsup_pars': {'slope': np.linspace(10, 30, 50)}}
+    tariffs: vector of tariff values of tariff_type ('Ave' or 'Specific')
+    base: parameter dict for all that is not in grid, defaults to pe_model.DEFAULTS
+    optimal: if True, also find the optimal tariff of each combination
+    workers: number of processes, defaults to os.cpu_count(). 1 runs in-process
+    chunksize: number of parameter combinations per task
+    continuation: if True, solve along the tariff vector with 
+                  TradeModel.trademodel_path() instead of trademodel_batch()
+    store: path to stream the results to (see store.py), one row per
+           combination and tariff with the columns of store_fields()
+    block: number of combinations held in memory at once when storing,
+           defaults to chunksize*workers
+
+    Returns a dict with
+        'axes': list of (section, name, values) of the grid
+        'tariffs': the tariffs
+        one array per field in FIELDS, shaped grid shape + (len(tariffs),)
+        with optimal=True one array per field in OPT_FIELDS, shaped as the grid
+    With store, the fields are instead the flat columns read back from
+    the store by read_results().
+    '''
+    base = mod.DEFAULTS if base is None else base
+    axes = param_axes(grid)
+    tariffs = np.atleast_1d(np.asarray(tariffs, dtype=float))
+    shape = tuple(len(v) for _, _, v in axes)
+    ncomb = int(np.prod(shape))
+    ntar = len(tariffs)
+    workers = os.cpu_count() if workers is None else workers
+    if store is None:
+        block = ncomb
+    else:
+        block = min(ncomb, chunksize*workers if block is None else block)
+
+    out_shape = (len(FIELDS), block, ntar)
+    opt_shape = (len(OPT_FIELDS), block)
+    shm = shared_memory.SharedMemory(create=True, size=max(8, 8*int(np.prod(out_shape))))
+    opt_shm = None
+    if optimal:
+        opt_shm = shared_memory.SharedMemory(create=True, size=max(8, 8*block*len(OPT_FIELDS)))
+
+    spec = {'base': base, 'axes': axes, 'tariffs': tariffs,
+            'tariff_type': tariff_type, 'optimal': optimal,
+            'continuation': continuation,
+            'out_name': shm.name, 'out_shape': out_shape,
+            'opt_name': opt_shm.name if optimal else None, 'opt_shape': opt_shape}
+    writer = None
+    if store is not None:
+        writer = ResultWriter(store, store_fields(axes, optimal), chunksize=block*ntar)
+    try:
+        out = np.ndarray(out_shape, dtype=np.float64, buffer=shm.buf)
+        opt = np.ndarray(opt_shape, dtype=np.float64, buffer=opt_shm.buf) if optimal else None
+        if workers == 1:
+            _worker.update(spec)
+            _worker['out'], _worker['opt'] = out, opt
+            pool = nullcontext()
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(spec,))
+        with pool:
+            for b0 in range(0, ncomb, block):
+                b1 = min(b0 + block, ncomb)
+                chunks = [(i, min(i + chunksize, b1), b0) for i in range(b0, b1, chunksize)]
+                if workers == 1:
+                    done = sum(_run_chunk(*chunk) for chunk in chunks)
+                else:
+                    done = sum(pool.map(_run_chunk, *zip(*chunks)))
+                assert done == b1 - b0
+                if writer is not None:
+                    _write_block(writer, axes, shape, tariffs, b0, b1, out, opt)
+        _worker.clear()
+
+        res = {'axes': axes, 'tariffs': tariffs}
+        if writer is not None:
+            writer.close()
+            res.update(read_results(store))
+        else:
+            for k, field in enumerate(FIELDS):
+                res[field] = out[k].reshape(shape + (ntar,)).copy()
+            if optimal:
+                for k, field in enumerate(OPT_FIELDS):
+                    res[field] = opt[k].reshape(shape).copy()
+        del out, opt
+    finally:
+        for b in [shm, opt_shm]:
+            if b is not None:
+                b.close()
+                b.unlink()
+
+    return res
+
+
+def _write_block(writer, axes, shape, tariffs, b0, b1, out, opt):
+    ''' Appends the results of combinations b0 ... b1-1 to writer'''
+    n, ntar = b1 - b0, len(tariffs)
+    idx = np.unravel_index(np.arange(b0, b1), shape)
+    cols = {f"{section}.{name}": np.repeat(values[j], ntar)
+            for (section, name, values), j in zip(axes, idx)}
+    cols['tariff'] = np.tile(tariffs, n)
+    for k, field in enumerate(FIELDS):
+        cols[field] = out[k, :n, :].ravel()
+    if opt is not None:
+        for k, field in enumerate(OPT_FIELDS):
+            cols[field] = np.repeat(opt[k, :n], ntar)
+    writer.append(**cols)
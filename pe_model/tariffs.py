@@ -24,11 +24,11 @@ class Specific(Tariff):
         self.unit = r'money per quantity, e.g. $/ton'
 
     def ave(self, p):
-        # defined over p = tariff-inclusive price
-        if np.isclose(p,0):
-            return np.nan
-        else: 
-            return self.value/p
+        # defined over p = tariff-inclusive price, scalar or array
+        p = np.asarray(p, dtype=float)
+        zero = np.isclose(p, 0)
+        res = np.where(zero, np.nan, self.value/np.where(zero, 1., p))
+        return res[()]
     
     def __str__(self):
         return f"{self.get_tartype()}, {self.get_unit()}. Value: {self.value} "
@@ -44,3 +44,85 @@ class Ave(Tariff):
     
     def __str__(self):
         return f"{self.get_tartype()}, {self.get_unit()}. Value: {self.value} "
+
+
+# type codes of the lines of a TariffSchedule
+AVE, SPECIFIC = 0, 1
+
+class TariffSchedule(Tariff):
+    ''' A schedule of tariff lines mixing ad-valorem and specific duties,
+    stored as a struct of arrays (10 bytes per line):
+        code:     int8, AVE (0) or SPECIFIC (1)
+        value:    float64, the duty
+        unitcode: int8, index of the unit of the line in units
+    All methods work on all lines at once. p can be a scalar or an array
+    that broadcasts against the lines.
+    '''
+    TYPES = {'Ave': AVE, 'Specific': SPECIFIC}
+
+    def __init__(self, code, value, unitcode=None, units=None):
+        code = np.asarray(code)
+        if code.dtype.kind in 'USO':
+            code = np.vectorize(self.TYPES.__getitem__, otypes=[np.int8])(code)
+        self.code = code.astype(np.int8)
+        Tariff.__init__(self, np.broadcast_to(np.asarray(value, dtype=float), 
+                                              self.code.shape).copy())
+        self.tartype = "tariff schedule"
+        self.units = (tuple(units) if units is not None 
+                      else (Ave(0).get_unit(), Specific(0).get_unit()))
+        self.unitcode = (self.code.copy() if unitcode is None 
+                         else np.asarray(unitcode, dtype=np.int8))
+        self.unit = 'per line, see units'
+
+    @classmethod
+    def from_tariffs(cls, tariffs):
+        ''' Builds a schedule from a list of Ave and Specific instances'''
+        code = [AVE if isinstance(t, Ave) else SPECIFIC for t in tariffs]
+        return cls(code, [t.value for t in tariffs])
+
+    def __len__(self):
+        return self.code.size
+
+    def __getitem__(self, idx):
+        ''' Returns line idx as Ave or Specific instance, or a sub-schedule 
+        for slices and index arrays'''
+        if np.ndim(self.code[idx]) == 0:
+            return (Ave if self.code[idx] == AVE else Specific)(float(self.value[idx]))
+        return TariffSchedule(self.code[idx], self.value[idx], 
+                              self.unitcode[idx], self.units)
+
+    @property
+    def nbytes(self):
+        return self.code.nbytes + self.value.nbytes + self.unitcode.nbytes
+
+    def wedges(self):
+        ''' Returns the arrays (a, s) of ad-valorem and specific parts of the
+        lines, so that the exporter receives p*(1-a) - s'''
+        ad = self.code == AVE
+        return np.where(ad, self.value, 0.), np.where(ad, 0., self.value)
+
+    def ave(self, p):
+        # ad-valorem equivalents at tariff-inclusive price p, nan for
+        # specific lines at p = 0
+        p = np.asarray(p, dtype=float)
+        zero = np.isclose(p, 0)
+        res = np.where(self.code == AVE, self.value,
+                       np.where(zero, np.nan, self.value/np.where(zero, 1., p)))
+        return res[()]
+
+    def exporter_price(self, p):
+        ''' Returns the price received by the exporter, p*(1-a) - s, 
+        at tariff-inclusive price p'''
+        a, s = self.wedges()
+        return p*(1. - a) - s
+
+    def inclusive_price(self, px):
+        ''' Returns the tariff-inclusive price (px + s)/(1-a) at which
+        the exporter receives px'''
+        a, s = self.wedges()
+        return (px + s)/(1. - a)
+
+    def __str__(self):
+        n_ave = int(np.count_nonzero(self.code == AVE))
+        return (f"{self.get_tartype()}: {len(self)} lines, {n_ave} ad-valorem, "
+                f"{len(self) - n_ave} specific")
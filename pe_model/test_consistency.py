@@ -0,0 +1,79 @@
+# test_consistency.py
+''' The batch, path, sample and multi-exporter solvers against the scalar
+trademodel(), run as: python -m pytest test_consistency.py'''
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import pe_model as mod
+from uq import SampleModel
+from multi import MultiTradeModel
+
+PARDIR = Path(__file__).parent / "params"
+TARS = np.array([0., 0.05, 0.2])
+TOL = 1e-10
+
+
+def calibration(name, slope=None):
+    params = json.loads((PARDIR / f"{name}.json").read_text())
+    if slope is not None:  # steep home demand, where illinois is slow
+        params['homedem_pars'] = dict(params['homedem_pars'], slope=slope)
+    return params
+
+
+CALIBRATIONS = {'linear': calibration('linear'),
+                'linlog': calibration('linlog'),
+                'linlog_steep12': calibration('linlog', -12.),
+                'linlog_steep15': calibration('linlog', -15.)}
+
+
+@pytest.fixture(scope='module', params=CALIBRATIONS)
+def params(request):
+    return CALIBRATIONS[request.param]
+
+
+@pytest.fixture(params=['Ave', 'Specific'])
+def tariff_type(request):
+    return request.param
+
+
+def scalar(params, tariff_type):
+    m = mod.TradeModel(params)
+    eqs = [m.trademodel(mod.create_tar_instance(tariff_type, v))[0] for v in TARS]
+    return {k: np.array([eq[k] for eq in eqs]) for k in ['pstar_t', 'pstar']}
+
+
+def test_batch(params, tariff_type):
+    ref = scalar(params, tariff_type)
+    eq = mod.TradeModel(params).trademodel_batch(TARS, tariff_type)
+    for k in ref:
+        np.testing.assert_allclose(eq[k], ref[k], rtol=0, atol=TOL)
+
+
+def test_path(params, tariff_type):
+    ref = scalar(params, tariff_type)
+    eq = mod.TradeModel(params).trademodel_path(TARS, tariff_type)
+    for k in ref:
+        np.testing.assert_allclose(eq[k], ref[k], rtol=0, atol=TOL)
+
+
+def test_sample(params, tariff_type):
+    ref = scalar(params, tariff_type)
+    # a sample of one draw, parameters are (m,1) arrays
+    draw = {k: {kk: np.array([[vv]]) for kk, vv in params[k].items()}
+            for k in ['homedem_pars', 'homesup_pars', 'forsup_pars']}
+    t = mod.create_tar_instance(tariff_type, TARS.reshape(1, -1))
+    p = SampleModel({**params, **draw}).equil_price(t)[0]
+    np.testing.assert_allclose(p, ref['pstar_t'], rtol=0, atol=TOL)
+
+
+def test_multi(params, tariff_type):
+    ref = scalar(params, tariff_type)
+    # a single exporter, the tariff is set per call
+    m = MultiTradeModel({**params, 'partners': [{'forsup_pars': params['forsup_pars'],
+                                                 'TAR_type': tariff_type, 'TAR_val': 0.}]})
+    p = np.array([m.trademodel(mod.create_tar_instance(tariff_type, v))['pstar_t']
+                  for v in TARS])
+    np.testing.assert_allclose(p, ref['pstar_t'], rtol=0, atol=TOL)
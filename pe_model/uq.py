@@ -0,0 +1,387 @@
+# uq.py
+"""Monte Carlo uncertainty quantification of welfare and the optimal tariff
+
+The parameters of the demand and supply functions are drawn from
+distributions, e.g. around noisy estimates,
+
+    dists = {'homedem_pars': {'slope': ('norm', -1.5, 0.15)},
+             'forsup_pars': {'const': ('uniform', 4.0, 2.0),
+                             'slope': ('lognorm', 0.1, 0, 0.9)}}
+
+with a scipy.stats distribution name and its arguments (or any frozen
+scipy.stats distribution), and the model is solved for every draw. Draws
+are plain random numbers or scrambled Sobol or Halton sequences
+(scipy.stats.qmc), transformed by the inverse distribution functions.
+
+A batch of draws is solved at once by SampleModel, a TradeModel whose
+parameters are arrays with one element per draw, so a batch costs a few
+array operations per solver iteration. The results of every batch are
+folded into StreamStats, which keeps means, variances, extremes and a
+fixed-size quantile sketch: memory does not grow with the number of draws.
+
+    res = run_uq(dists, 2**20, base=params, tariffs=[0.1, 0.2, 0.3])
+    res['total']['mean'], res['total']['quantile_ci']
+"""
+
+import functools
+
+import numpy as np
+
+import pe_model as mod
+import instrument
+import tariffs as tars
+from diskcache import digest
+from solvers import golden
+from kitchen import pretty_print
+
+# outputs per draw and tariff, and per draw with optimal=True
+FIELDS = ['total', 'net_world']
+OPT_FIELDS = ['opt_tariff', 'opt_ave', 'opt_welf']
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+################################################################
+# drawing parameters
+################################################################
+
+def param_dists(dists):
+    ''' Flattens a dict of distributions into a list of (section, name, dist),
+    with dist a frozen scipy.stats distribution'''
+    from scipy import stats
+    res = []
+    for section, pars in dists.items():
+        for name, dist in pars.items():
+            if not hasattr(dist, 'ppf'):
+                dist = getattr(stats, dist[0])(*dist[1:])
+            res.append((section, name, dist))
+    return res
+
+
+def uniform_sampler(ndim, method='sobol', seed=None):
+    ''' Returns a function u(m) drawing the next m points of the unit cube
+    [0, 1)^ndim, as an (m, ndim) array.
+    method: 'random', or the scrambled quasi-random 'sobol' or 'halton' '''
+    if method == 'random':
+        rng = np.random.default_rng(seed)
+        return lambda m: rng.random((m, ndim))
+    from scipy.stats import qmc
+    if method == 'sobol':
+        engine = qmc.Sobol(ndim, scramble=True, seed=seed)
+    elif method == 'halton':
+        engine = qmc.Halton(ndim, scramble=True, seed=seed)
+    else:
+        raise ValueError(f"Unknown sampling method: {method}")
+    return engine.random
+
+
+def draw_params(base, dists, u):
+    ''' Returns the parameter dict of base with the parameters in dists
+    (see param_dists) replaced by columns of arrays, shaped (m, 1),
+    from the uniform draws u (m, ndim)'''
+    params = {k: (dict(v) if isinstance(v, dict) else v) for k, v in base.items()}
+    # keep away from 0 and 1, where unbounded distributions are infinite
+    u = np.clip(u, 1e-12, 1. - 1e-12)
+    for j, (section, name, dist) in enumerate(dists):
+        params[section][name] = dist.ppf(u[:, j:j+1])
+    for section in ["homedem_pars", "homesup_pars", "forsup_pars"]:
+        params[section] = {k: np.broadcast_to(np.asarray(v, dtype=float), (len(u), 1))
+                           for k, v in params[section].items()}
+    return params
+
+
+################################################################
+# the model for a batch of parameter draws
+################################################################
+
+class SampleModel(mod.TradeModel):
+    ''' The large country PE model for a batch of parameter sets: every
+    parameter is an array of shape (m, 1), one row per draw. Prices,
+    quantities and welfare come out as arrays of shape (m, k) for k tariffs
+    (tariff values shaped (1, k) or (m, k)).
+
+    The autarky and free trade equilibria, the equilibrium prices and the
+    optimal tariff are solved for all draws at once, the other methods
+    are those of TradeModel.
+    '''
+
+    @property
+    def key(self):
+        ''' digest of the parameter arrays, used by the caches'''
+        return ('samples', digest(self.SYSTEM, dict(self.homedem_pars),
+                                  dict(self.homesup_pars), dict(self.forsup_pars)))
+
+    def __len__(self):
+        return len(self.homedem_pars["const"])
+
+    def home_notrade_equil(self):
+        ''' Returns the arrays of autarky prices and quantities'''
+        return self._notrade
+
+    @functools.cached_property
+    def _notrade(self):
+        # parameters are frozen, so solved once per batch
+        if self.SYSTEM == 'lin':
+            hd, hs = self.homedem_pars, self.homesup_pars
+            p = (hd["const"] - hs["const"]) / (hs["slope"] - hd["slope"])
+        else:
+            # as TradeModel, draws without equilibrium are nan and dropped
+            p, _ = mod.solve_batch(self.impdem, np.full((len(self), 1), 0.5),
+                                   np.full((len(self), 1), 2.), failed='nan')
+        return (p, self.homedem(p))
+
+    def equil_price(self, t):
+        ''' Returns the tariff-inclusive equilibrium prices for tariff t,
+        whose value can be an array of shape (1, k) or (m, k)'''
+        if self.SYSTEM == 'lin':
+            return self.lin_equil_price(t)
+
+        def equil(p):
+            return self.impdem(p) - self.expsup(p, t)
+
+        P0, _ = self.home_notrade_equil()
+        # between the free trade and autarky prices, as TradeModel
+        lo = self.free_trade_equil()[0] if isinstance(t, tars.Tariff) else P0/2
+        shape = np.broadcast_shapes(np.shape(P0), np.shape(getattr(t, 'value', 0.)))
+        p, _ = mod.solve_batch(equil, np.broadcast_to(lo, shape), np.broadcast_to(P0, shape),
+                               failed='nan')
+        return p
+
+    def free_trade_equil(self):
+        ''' Returns the arrays of world prices and imports under free trade'''
+        PW = self.equil_price(0)
+        return (PW, self.expsup(PW, t=0))
+
+    def find_optimal_tariff(self, tariff_type=None, objective='total', xtol=1e-8):
+        ''' Finds the optimal tariff of every draw at once, by golden section
+        search between free trade and the prohibitive tariff.
+        Returns the dict of TradeModel.find_optimal_tariff(), holding arrays'''
+        tariff_type = self.TAR_type if tariff_type is None else tariff_type
+        score = mod.welfare_objective(objective)
+        pw, _ = self.free_trade_equil()
+
+        def neg_welf(v):
+            t = mod.create_tar_instance(tariff_type, v)
+            p_t = self.equil_price(t)
+            return -score(self.home_welf(pw, p_t, self.expprice(self.expsup(p_t, t))))
+
+        upper = self.prohibitive_tariff(tariff_type)
+        x, nit, converged = golden(neg_welf, np.zeros_like(upper), upper, xtol)
+        stats = instrument.current()
+        if stats is not None:
+            stats.solver('golden', converged, nit=nit, nfev=nit + 2)
+
+        tar = mod.create_tar_instance(tariff_type, x)
+        p_t = self.equil_price(tar)
+        return {'tariff': x,
+                'ave': tar.ave(p_t),
+                'welf': -neg_welf(x),
+                'nfev': nit + 3,
+                'success': converged}
+
+    def outcomes(self, tariffs, tariff_type, optimal=True, objective='total'):
+        ''' Returns a dict of the FIELDS (arrays (m, k) for the k tariffs)
+        and with optimal=True the OPT_FIELDS (arrays (m,)), and 'valid':
+        the draws with positive free trade imports and finite results'''
+        P0, _ = self.home_notrade_equil()
+        pw, m1 = self.free_trade_equil()
+        t = mod.create_tar_instance(tariff_type, np.reshape(tariffs, (1, -1)))
+        p_t = self.equil_price(t)
+        pstar = self.expprice(self.expsup(p_t, t))
+        w_home = self.home_welf(pw, p_t, pstar)
+        w_world = mod.world_welf(w_home, self.foreign_welf(pw, pstar))
+
+        res = {'total': w_home['total'], 'net_world': w_world['Net WORLD']}
+        if optimal:
+            opt = self.find_optimal_tariff(tariff_type, objective)
+            res.update({'opt_tariff': opt['tariff'], 'opt_ave': opt['ave'],
+                        'opt_welf': opt['welf']})
+        res = {k: np.reshape(v, (len(self), -1)) for k, v in res.items()}
+
+        valid = (P0 > 0) & (pw > 0) & (m1 > 0)
+        for v in res.values():
+            valid = valid & np.isfinite(v).all(axis=1, keepdims=True)
+        res = {k: (v if k in FIELDS else v[:, 0]) for k, v in res.items()}
+        res['valid'] = valid[:, 0]
+        return res
+
+
+################################################################
+# streaming statistics
+################################################################
+
+class StreamStats():
+    ''' Streaming statistics of k outputs per draw: count, mean, variance,
+    extremes, and quantiles from a sketch of at most size weighted points
+    per output (rank error about 1/size). Memory does not depend on the
+    number of draws. k=None for a single output, whose results are scalars'''
+
+    def __init__(self, k=None, size=4096):
+        self.scalar = k is None
+        k = 1 if k is None else k
+        self.size = size
+        self.n = 0
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros(k)
+        self.min = np.full(k, np.inf)
+        self.max = np.full(k, -np.inf)
+        self._sketch = [(np.empty(0), np.empty(0)) for _ in range(k)]
+
+    def update(self, x):
+        ''' Folds in the draws x, an array (m,) or (m, k)'''
+        x = np.asarray(x, dtype=float).reshape(len(x), -1)
+        m = len(x)
+        if m == 0:
+            return
+        # Chan et al.'s pairwise update of mean and sum of squares
+        mean_b = x.mean(axis=0)
+        m2_b = ((x - mean_b)**2).sum(axis=0)
+        n = self.n + m
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta*m/n
+        self.m2 = self.m2 + m2_b + delta**2*self.n*m/n
+        self.n = n
+        self.min = np.minimum(self.min, x.min(axis=0))
+        self.max = np.maximum(self.max, x.max(axis=0))
+        for j, (v, w) in enumerate(self._sketch):
+            self._sketch[j] = self._compress(np.concatenate([v, x[:, j]]),
+                                             np.concatenate([w, np.ones(m)]))
+
+    def _compress(self, v, w):
+        # sorted points, beyond size merged into size bins of equal weight
+        order = np.argsort(v, kind='stable')
+        v, w = v[order], w[order]
+        if len(v) <= self.size:
+            return v, w
+        cw = np.cumsum(w)
+        b = np.minimum(((cw - w/2) / cw[-1] * self.size).astype(int), self.size - 1)
+        wb = np.bincount(b, weights=w, minlength=self.size)
+        vb = np.bincount(b, weights=w*v, minlength=self.size)
+        keep = wb > 0
+        return vb[keep]/wb[keep], wb[keep]
+
+    def quantile(self, q):
+        ''' Returns the estimated quantiles q, an array (len(q), k)'''
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        res = np.full((len(q), len(self._sketch)), np.nan)
+        for j, (v, w) in enumerate(self._sketch):
+            if len(v) == 0:
+                continue
+            cw = np.cumsum(w)
+            rank = np.concatenate([[0.], (cw - w/2) / cw[-1], [1.]])
+            res[:, j] = np.interp(q, rank, np.concatenate([[self.min[j]], v, [self.max[j]]]))
+        return res
+
+    def result(self, quantiles=QUANTILES, level=0.95):
+        ''' Returns a dict with n, mean, std, min, max, the quantiles, and
+        the confidence bands at level:
+            mean_ci:     (lo, hi) of the mean, from the central limit theorem
+            quantile_ci: (lo, hi) of each quantile q, the quantiles at
+                         q -+ z*sqrt(q*(1-q)/n) (distribution free)
+        The bands assume independent draws, for Sobol and Halton draws
+        they are conservative'''
+        from scipy.stats import norm
+        z = norm.ppf(0.5 + level/2)
+        n = max(self.n, 1)
+        std = np.sqrt(self.m2/max(self.n - 1, 1))
+        se = std/np.sqrt(n)
+        q = np.asarray(quantiles, dtype=float)
+        dq = z*np.sqrt(q*(1. - q)/n)
+        res = {'n': self.n, 'mean': self.mean, 'std': std, 'min': self.min, 'max': self.max,
+               'mean_ci': (self.mean - z*se, self.mean + z*se),
+               'quantiles': self.quantile(q),
+               'quantile_ci': (self.quantile(np.clip(q - dq, 0., 1.)),
+                               self.quantile(np.clip(q + dq, 0., 1.)))}
+        if self.scalar:
+            res = {k: (v if k == 'n' else
+                       tuple(a[..., 0] for a in v) if isinstance(v, tuple) else v[..., 0])
+                   for k, v in res.items()}
+        return res
+
+
+################################################################
+# running
+################################################################
+
+def run_uq(dists, n, base=None, method='sobol', seed=None, tariffs=None,
+           tariff_type=None, optimal=True, objective='total', batch=2**14,
+           quantiles=QUANTILES, level=0.95, size=4096):
+    ''' Draws n parameter sets and returns the statistics of the welfare
+    outcomes and of the optimal tariff over them.
+
+    dists: distributions of the parameters, see the module docstring
+    base: parameter dict for all that is not in dists, defaults to pe_model.DEFAULTS
+    method: 'random', 'sobol' or 'halton' (scrambled), see uniform_sampler()
+    tariffs: tariff values at which home welfare ('total') and world
+             welfare ('net_world', the "Net WORLD" of world_welf) are
+             evaluated, defaults to TAR_val of base
+    tariff_type: 'Ave' or 'Specific', defaults to TAR_type of base
+    optimal: if True, also the optimal tariff of each draw, see
+             TradeModel.find_optimal_tariff(). objective as there
+    batch: number of draws solved at once, powers of 2 suit Sobol draws
+    quantiles, level: quantiles and confidence level of StreamStats.result()
+    size: size of the quantile sketches
+
+    Returns a dict with
+        'n': number of valid draws, 'dropped': draws without trade or results
+        'tariffs', 'quantiles', 'level'
+        one StreamStats.result() per output in FIELDS (arrays over tariffs)
+        and with optimal=True in OPT_FIELDS (scalars)
+    '''
+    base = mod.DEFAULTS if base is None else {**mod.DEFAULTS, **base}
+    tariff_type = base["TAR_type"] if tariff_type is None else tariff_type
+    tariffs = np.atleast_1d(np.asarray(base["TAR_val"] if tariffs is None else tariffs,
+                                       dtype=float))
+    dists = param_dists(dists)
+    sample = uniform_sampler(len(dists), method, seed)
+
+    stats = {k: StreamStats(len(tariffs), size) for k in FIELDS}
+    if optimal:
+        stats.update({k: StreamStats(None, size) for k in OPT_FIELDS})
+    dropped = 0
+    for b0 in range(0, n, batch):
+        m = min(batch, n - b0)
+        model = SampleModel(draw_params(base, dists, sample(m)))
+        with np.errstate(all='ignore'):
+            res = model.outcomes(tariffs, tariff_type, optimal, objective)
+        valid = res.pop('valid')
+        dropped += m - np.count_nonzero(valid)
+        for k, v in res.items():
+            stats[k].update(v[valid])
+
+    out = {'n': n - dropped, 'dropped': dropped, 'tariffs': tariffs,
+           'quantiles': np.asarray(quantiles), 'level': level}
+    out.update({k: s.result(quantiles, level) for k, s in stats.items()})
+    return out
+
+
+#%% Trial run: 10% uncertainty on the slopes of the linlog calibration
+
+def trial_run(n=2**16):
+    params = {"SYSTEM": "linlog", "TAR_type": "Ave", "TAR_val": 0.1,
+              "homedem_pars": {"const": 2.0, "slope": -1.5},
+              "homesup_pars": {"const": 2.0, "slope": 0.5},
+              "forsup_pars": {"const": 5.0, "slope": 0.9}}
+    dists = {section: {'slope': ('norm', params[section]['slope'],
+                                 0.1*abs(params[section]['slope']))}
+             for section in ["homedem_pars", "homesup_pars", "forsup_pars"]}
+    res = run_uq(dists, n, base=params, tariffs=[0.1, 0.2])
+
+    print('*'*20)
+    print(f"Monte Carlo of {res['n']} Sobol draws ({res['dropped']} dropped), "
+          f"{res['level']:.0%} band of the mean in mean lo .. mean hi")
+    for k in ['total', 'net_world'] + OPT_FIELDS:
+        r = res[k]
+        for j in range(np.size(r['mean'])):
+            label = k if k in OPT_FIELDS else f"{k} at tariff {res['tariffs'][j]}"
+            mean = np.ravel(r['mean'])[j]
+            lo, hi = [np.ravel(a)[j] for a in r['mean_ci']]
+            qs = np.reshape(r['quantiles'], (len(res['quantiles']), -1))[:, j]
+            out = {'mean': mean, 'mean lo': lo, 'mean hi': hi, 'std': np.ravel(r['std'])[j]}
+            out.update({f"q{q:g}": v for q, v in zip(res['quantiles'], qs)})
+            out = {k2: round(float(v), 4) for k2, v in out.items()}
+            print(f"{label}\n{pretty_print(out, fw=16, dig=4, indent=1)}")
+    print('*'*20)
+
+
+if __name__ == '__main__':
+    trial_run()